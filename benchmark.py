@@ -0,0 +1,1048 @@
+# Benchmarks for the ejw45 Amazons engine.
+#
+# Usage: python benchmark.py [name ...] [--json results.json] [--compare baseline.json]
+# With no names every benchmark is run. Each benchmark prints a short report.
+#
+# The suite benchmarks (positions, lookups, simulate, areas, decision) also return their
+# measurements, taken on fixed seeded positions: --json saves them with a description of
+# the machine, and --compare checks them against a saved run, flagging every measurement
+# that got worse by more than --threshold and exiting with status 1 if any did.
+# Measurements named *_seconds are better lower, every other one is better higher.
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import subprocess
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import main
+import perft
+
+
+# seed for the suite's fixed positions and for every benchmark's random choices; see --seed
+SEED = 0
+
+
+def opening_config():
+    game_board = main.Board(10, tuple(map(main.ld2rc, 'd0 g0 a3 j3'.split())),
+                            tuple(map(main.ld2rc, 'a6 j6 d9 g9'.split())))
+    return game_board.config
+
+
+def rate(function, min_time=1.0):
+    """Call function repeatedly for at least min_time seconds; return (calls, seconds, last result)."""
+    calls = 0
+    result = None
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        result = function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return calls, elapsed, result
+
+
+def bench_movegen(min_time):
+    """Moves generated per second on the opening position: ejw45_Board against ejw45_BitBoard."""
+    config = opening_config()
+
+    old = main.ejw45_Board(np.array(config))
+    new = main.ejw45_BitBoard.from_config(config, white_to_move=True)
+
+    old_calls, old_time, (_, old_moves) = rate(lambda: old.moves(True), min_time)
+    new_calls, new_time, new_moves = rate(new.moves, min_time)
+
+    assert sorted(old_moves) == sorted(new.to_move(move) for move in new_moves)
+
+    old_rate = old_calls * len(old_moves) / old_time
+    new_rate = new_calls * len(new_moves) / new_time
+    print('movegen: {} legal moves at the opening'.format(len(new_moves)))
+    print('  ejw45_Board    {:>12,.0f} moves/sec'.format(old_rate))
+    print('  ejw45_BitBoard {:>12,.0f} moves/sec ({:.1f}x)'.format(new_rate, new_rate / old_rate))
+
+
+def bench_playout(min_time):
+    """Full select/expand/rollout playouts per second and the peak memory a single playout allocates."""
+    engine = main.ejw45_MonteCarlo(path=None)
+
+    calls, elapsed, _ = rate(engine.simulate, min_time)
+
+    peaks = []
+    for _ in range(5):
+        tracemalloc.start()
+        engine.simulate()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    print('playout: {:.1f} playouts/sec, peak {:.1f} KiB per playout (max of 5)'.format(
+        calls / elapsed, max(peaks) / 1024.0))
+
+
+def random_positions(count, seed=0):
+    """Distinct positions reached by random games from the opening, as ejw45_BitBoard copies."""
+    rng = random.Random(seed)
+    positions = {}
+    while len(positions) < count:
+        state = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+        while len(positions) < count:
+            moves = state.moves()
+            if not moves:
+                break
+            state.apply(rng.choice(moves))
+            positions[(state.white, state.black, state.arrows, state.white_to_move)] = state.copy()
+    return list(positions.values())
+
+
+def bench_hashing(min_time):
+    """Zobrist collision rate over random positions and explored-table lookups per second."""
+    positions = random_positions(50000)
+
+    for state in positions[:1000]:
+        assert state.key() == state.zobrist.key(state.white, state.black, state.arrows, state.white_to_move)
+
+    collisions = len(positions) - len(set(state.key() for state in positions))
+    print('hashing: {} collisions among {} distinct positions'.format(collisions, len(positions)))
+
+    boards = [main.ejw45_Board(np.array(state.to_config())) for state in positions[:2000]]
+    by_string = dict((str(board.board), (1, 1)) for board in boards)
+    by_key = dict((state.key(), (1, 1)) for state in positions[:2000])
+    keys = [state.key() for state in positions[:2000]]
+
+    def string_lookups():
+        for board in boards:
+            by_string[str(board.board)]
+
+    def key_lookups():
+        for key in keys:
+            by_key[key]
+
+    old_calls, old_time, _ = rate(string_lookups, min_time)
+    new_calls, new_time, _ = rate(key_lookups, min_time)
+    old_rate = old_calls * len(boards) / old_time
+    new_rate = new_calls * len(keys) / new_time
+    print('  str(board) keys {:>12,.0f} lookups/sec'.format(old_rate))
+    print('  Zobrist keys    {:>12,.0f} lookups/sec ({:.0f}x)'.format(new_rate, new_rate / old_rate))
+
+
+def tree_bytes(root):
+    """Bytes held by the search tree: the nodes, their child lists and their cached untried moves."""
+    total = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        total += sys.getsizeof(node) + sys.getsizeof(node.children)
+        if node.untried is not None:
+            total += sys.getsizeof(node.untried) + sum(sys.getsizeof(move) for move in node.untried)
+        stack.extend(node.children)
+    return total
+
+
+def bench_tree(min_time):
+    """Playouts per second through the search tree and the memory each tree node takes."""
+    engine = main.ejw45_MonteCarlo(path=None)
+
+    calls, elapsed, _ = rate(engine.simulate, min_time)
+    nodes = engine.root.size()
+
+    print('tree: {:.1f} playouts/sec, {} nodes, {:.0f} bytes/node'.format(
+        calls / elapsed, nodes, tree_bytes(engine.root) / float(nodes)))
+
+
+def tree_depth(root):
+    """Deepest whole-move ply in the tree (queen nodes do not count)."""
+    deepest = 0
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + (child.key is not None)) for child in node.children)
+    return deepest
+
+
+def bench_widening(min_time):
+    """Flat expansion against two-stage queen/arrow nodes with progressive widening, from the opening."""
+    modes = [('flat', False, None), ('two-stage', True, None), ('two-stage + widening', True, 1.0)]
+
+    for cap in (None, 0):
+        print('widening: rollout_cap={}'.format(cap))
+        for name, two_stage, widening in modes:
+            engine = main.ejw45_MonteCarlo(path=None)
+            engine.two_stage = two_stage
+            engine.widening = widening
+            engine.rollout_cap = cap
+
+            random.seed(0)
+            calls, elapsed, _ = rate(engine.simulate, min_time)
+            nodes = engine.root.size()
+            print('  {:<21} {:>8.1f} playouts/sec, {:>6} nodes ({:.2f}/playout), {:>5.0f} bytes/playout, '
+                  '{} root children, depth {}'.format(
+                      name, calls / elapsed, nodes, nodes / float(calls), tree_bytes(engine.root) / float(calls),
+                      len(engine.root.children), tree_depth(engine.root)))
+
+
+def bench_parallel(min_time):
+    """Root-parallel playouts per second against the number of worker processes."""
+    state = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+    cores = os.cpu_count() or 1
+    counts = sorted(set([workers for workers in (1, 2, 4, 8, 16, 32) if workers <= cores] + [cores]))
+
+    print('parallel: {} cores'.format(cores))
+    baseline = None
+    for workers in counts:
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.workers = workers
+        engine.time_margin = 0.0
+        engine.reroot(state)
+
+        start = time.perf_counter()
+        iterations, _ = engine.parallel_search(start + min_time + engine.merge_margin)
+        elapsed = time.perf_counter() - start
+        if engine.pool is not None:
+            engine.pool.shutdown()
+
+        playouts = iterations / elapsed
+        if baseline is None:
+            baseline = playouts
+        print('  {:>2} workers {:>8.1f} playouts/sec ({:.2f}x)'.format(workers, playouts, playouts / baseline))
+
+
+def bench_rollout(min_time):
+    """Random rollouts per second from the opening: one at a time against the batched NumPy kernel."""
+    engine = main.ejw45_MonteCarlo(path=None)
+    engine.rollout_cap = None
+    start = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+    kernel = main.ejw45_BatchPlayout.for_size(start.size)
+    rng = np.random.default_rng(0)
+    games = 256
+
+    calls, elapsed, _ = rate(lambda: engine.rollout(start.copy()), min_time)
+    single = calls / elapsed
+    batch_calls, batch_elapsed, white_won = rate(lambda: kernel.run(start, games, rng), min_time)
+    batched = batch_calls * games / batch_elapsed
+
+    print('rollout: white won {:.0%} of a batch of {}'.format(white_won.mean(), games))
+    print('  one at a time {:>10.1f} rollouts/sec'.format(single))
+    print('  batched       {:>10.1f} rollouts/sec ({:.1f}x)'.format(batched, batched / single))
+
+
+def fixed_positions():
+    """The suite's opening, midgame and endgame positions, the same for a given SEED."""
+    rng = random.Random(SEED)
+    opening = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+
+    midgame = opening.copy()
+    for _ in range(20):
+        midgame.apply(rng.choice(midgame.moves()))
+
+    # the first position of a random game where the queens are walled off
+    endgame = midgame.copy()
+    while not endgame.separated():
+        endgame.apply(rng.choice(endgame.moves()))
+
+    return [('opening', opening), ('midgame', midgame), ('endgame', endgame)]
+
+
+def bench_positions(min_time):
+    """Move generation on the fixed positions: ejw45_Board.moves, queen_moves and position_moves, and ejw45_BitBoard."""
+    results = {}
+    print('positions: move generation, calls/sec (moves/sec for whole move lists)')
+    for phase, state in fixed_positions():
+        board = main.ejw45_Board(np.array(state.to_config()))
+        symbol = 'Q' if state.white_to_move else 'q'
+        queens = [tuple(square) for square in np.argwhere(board.board == symbol)]
+
+        calls, elapsed, (_, moves) = rate(lambda: board.moves(state.white_to_move), min_time)
+        results[phase + '.board_moves_per_sec'] = calls * len(moves) / elapsed
+        calls, elapsed, _ = rate(lambda: board.queen_moves(state.white_to_move), min_time)
+        results[phase + '.queen_moves_per_sec'] = calls / elapsed
+        calls, elapsed, _ = rate(lambda: [board.position_moves(queen) for queen in queens], min_time)
+        results[phase + '.position_moves_per_sec'] = calls * len(queens) / elapsed
+        calls, elapsed, _ = rate(state.moves, min_time)
+        results[phase + '.bitboard_moves_per_sec'] = calls * len(moves) / elapsed
+
+        print('  {:<8} {:>5} moves  ejw45_Board.moves {:>10,.0f}  queen_moves {:>8,.0f}  position_moves {:>8,.0f}'
+              '  ejw45_BitBoard.moves {:>10,.0f}'.format(
+                  phase, len(moves), results[phase + '.board_moves_per_sec'], results[phase + '.queen_moves_per_sec'],
+                  results[phase + '.position_moves_per_sec'], results[phase + '.bitboard_moves_per_sec']))
+    return results
+
+
+def bench_lookups(min_time):
+    """Position keys and explored lookups: ejw45_Board.__hash__, Zobrist and canonical keys, ejw45_Table.get."""
+    positions = random_positions(2000, SEED)
+    configs = [np.array(state.to_config()) for state in positions]
+
+    # ejw45_Board caches its key, so every call hashes a fresh board
+    calls, elapsed, _ = rate(lambda: [hash(main.ejw45_Board(config)) for config in configs], min_time)
+    board_hash = calls * len(configs) / elapsed
+    calls, elapsed, _ = rate(lambda: [state.key() for state in positions], min_time)
+    zobrist = calls * len(positions) / elapsed
+    calls, elapsed, _ = rate(lambda: [state.canonical_key() for state in positions], min_time)
+    canonical = calls * len(positions) / elapsed
+
+    table = main.ejw45_Table()
+    keys = [state.canonical_key() for state in positions]
+    for key in keys[::2]:
+        table[key] = (1, 2)
+    calls, elapsed, _ = rate(lambda: [table.get(key) for key in keys], min_time)
+    explored = calls * len(keys) / elapsed
+
+    print('lookups: per second over {} positions'.format(len(positions)))
+    print('  ejw45_Board.__hash__ {:>12,.0f}'.format(board_hash))
+    print('  Zobrist key          {:>12,.0f}'.format(zobrist))
+    print('  canonical key        {:>12,.0f}'.format(canonical))
+    print('  explored get (50% hits) {:>9,.0f}'.format(explored))
+    return {
+        'board_hash_per_sec': board_hash,
+        'zobrist_key_per_sec': zobrist,
+        'canonical_key_per_sec': canonical,
+        'explored_get_per_sec': explored,
+    }
+
+
+def bench_simulate(min_time):
+    """Whole simulate() playouts per second from each fixed position, with the engine's defaults."""
+    results = {}
+    print('simulate: playouts/sec')
+    for phase, state in fixed_positions():
+        random.seed(SEED)
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.reroot(state)
+        calls, elapsed, _ = rate(engine.simulate, min_time)
+        results[phase + '.playouts_per_sec'] = calls / elapsed
+        print('  {:<8} {:>8.1f}'.format(phase, calls / elapsed))
+    return results
+
+
+def bench_areas(min_time):
+    """Board.count_areas, the reference floodfill, against the ejw45_RegionTracker that Board.end_turn uses."""
+    results = {}
+    print('areas: calls/sec')
+    for phase, state in fixed_positions():
+        board = main.Board.from_config(state.to_config())
+        assert board.count_areas() == board.regions.count_areas()
+
+        calls, elapsed, _ = rate(board.count_areas, min_time)
+        results[phase + '.count_areas_per_sec'] = calls / elapsed
+        calls, elapsed, _ = rate(board.regions.count_areas, min_time)
+        results[phase + '.tracker_per_sec'] = calls / elapsed
+        print('  {:<8} count_areas {:>10,.0f}  ejw45_RegionTracker {:>10,.0f}'.format(
+            phase, results[phase + '.count_areas_per_sec'], results[phase + '.tracker_per_sec']))
+    return results
+
+
+def bench_decision(min_time):
+    """End to end ejw45_bot decisions from the fixed positions, searching for min_time seconds each."""
+    results = {}
+    saved = main.ejw45_mc
+    print('decision: ejw45_bot with {:.1f}s to search'.format(min_time))
+    for phase, state in fixed_positions():
+        random.seed(SEED)
+        engine = main.ejw45_MonteCarlo(path=None)
+        main.ejw45_mc = engine
+
+        board = main.Board.from_config(state.to_config(), state.white_to_move)
+
+        main.profiler.enabled = True
+        mark = main.profiler.mark()
+        start = time.perf_counter()
+        board.time_limit = start + engine.time_margin + min_time
+        with contextlib.redirect_stdout(io.StringIO()):
+            move = main.ejw45_bot(board)
+        elapsed = time.perf_counter() - start
+        summary = main.profiler.summary(mark)
+        main.profiler.enabled = False
+
+        assert move and board.valid_move(*move)
+        results[phase + '.decision_seconds'] = elapsed
+        results[phase + '.playouts'] = summary['playouts']
+        print('  {:<8} {:>6.3f}s {:>6} playouts'.format(phase, elapsed, summary['playouts']))
+
+    main.ejw45_mc = saved
+    return results
+
+
+def bench_adjudication(min_time):
+    """Rollout length and rollouts per second when played out, adjudicated on separation, and capped."""
+    start = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+    kernel = main.ejw45_BatchPlayout.for_size(start.size)
+    rng = np.random.default_rng(0)
+    games = 256
+
+    print('adjudication: rollouts from the opening')
+    for label, adjudicate, cap in (('played out', False, None), ('separation', True, None),
+                                   ('separation, cap 20', True, 20)):
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.adjudicate = adjudicate
+        engine.rollout_cap = cap
+
+        plies = []
+
+        def rollout():
+            state = start.copy()
+            engine.rollout(state)
+            plies.append(main.ejw45_popcount(state.arrows))
+
+        calls, elapsed, _ = rate(rollout, min_time)
+        batch_calls, batch_elapsed, _ = rate(lambda: kernel.run(start, games, rng, adjudicate, cap), min_time)
+
+        print('  {:<20} {:>5.1f} plies {:>8.1f} rollouts/sec {:>8.1f} batched rollouts/sec'.format(
+            label, sum(plies) / float(len(plies)), calls / elapsed, batch_calls * games / batch_elapsed))
+
+
+def random_game(seed):
+    """The moves of one random game from the opening, in square numbers."""
+    rng = random.Random(seed)
+    state = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+    moves = []
+    while True:
+        legal = state.moves()
+        if not legal:
+            return moves
+        move = rng.choice(legal)
+        state.apply(move)
+        moves.append(move)
+
+
+def small_start():
+    """:return: the 6x6 start position the strength benchmarks play from"""
+    queens = ('a1 b0 e0 f1', 'a4 b5 e5 f4')
+    board = main.Board(6, *[tuple(map(main.ld2rc, side.split())) for side in queens])
+    return main.ejw45_BitBoard.from_config(board.config, white_to_move=True)
+
+
+def play_game(white, black, playouts=None, seconds=None, start=None):
+    """
+    Play a game between two engines searching playouts playouts, or for seconds seconds, per move.
+    Once the queens are walled off the game goes to the side with more territory.
+    :param start: position to play from, or None for small_start
+    :return: True if white won
+    """
+    state = start.copy() if start is not None else small_start()
+    while True:
+        engine = white if state.white_to_move else black
+        engine.reroot(state)
+        if seconds is not None:
+            engine.search(time.perf_counter() + seconds + engine.time_margin)
+        else:
+            for _ in range(playouts):
+                engine.simulate()
+        move = engine.best_move(state)
+        if move is None:
+            return not state.white_to_move
+        state.apply(move)
+
+        if state.separated():
+            white_region, black_region = state.regions()
+            margin = main.ejw45_popcount(white_region) - main.ejw45_popcount(black_region)
+            return main.ejw45_white_wins(margin, state.white_to_move)
+
+
+def match(games, first, second, playouts=None, seconds=None, start=None):
+    """
+    Play games games with play_game, colours alternating.
+    :param first, second: functions of the game number making each side's engine
+    :return: the games first won
+    """
+    wins = 0
+    for game in range(games):
+        random.seed(game)
+        engine, other = first(game), second(game)
+        if game % 2 == 0:
+            wins += play_game(engine, other, playouts, seconds, start)
+        else:
+            wins += not play_game(other, engine, playouts, seconds, start)
+    return wins
+
+
+def bench_rave(min_time):
+    """Games on 6x6 with a fixed number of playouts per move: RAVE blended into selection against plain UCB1."""
+    playouts = 100
+    games = max(2, 2 * int(min_time * 5))
+
+    def plain(game):
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.rave_equivalence = None
+        return engine
+
+    start = time.perf_counter()
+    wins = match(games, lambda game: main.ejw45_MonteCarlo(path=None), plain, playouts)
+    print('rave: won {}/{} games on 6x6 at {} playouts/move against plain UCB1 ({:.0f}s)'.format(
+        wins, games, playouts, time.perf_counter() - start))
+
+
+def bench_prior(min_time):
+    """Games on 6x6 after training: nodes seeded from the trained explored table against nodes started empty."""
+    playouts = 100
+    games = max(2, 2 * int(min_time * 5))
+
+    random.seed(SEED)
+    trainer = main.ejw45_MonteCarlo(path=None)
+    trainer.tree_limit = 5000
+    trainer.reroot(small_start())
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.train(1000 * games)
+    trained = time.perf_counter() - start
+
+    def seeded(game):
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.explored = copy.deepcopy(trainer.explored)
+        return engine
+
+    def empty(game):
+        engine = seeded(game)
+        engine.prior_visits = 0
+        return engine
+
+    start = time.perf_counter()
+    wins = match(games, seeded, empty, playouts)
+    print('prior: won {}/{} games on 6x6 at {} playouts/move seeding nodes from {} trained entries '
+          '({:.0f}s training, {:.0f}s playing)'.format(
+              wins, games, playouts, len(trainer.explored), trained, time.perf_counter() - start))
+
+
+def bench_cap(min_time):
+    """Games on 10x10 at equal time per move: rollouts capped at rollout_cap plies against rollouts played out."""
+    seconds = 0.1
+    games = max(2, 2 * int(min_time * 5))
+    start = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+
+    def uncapped(game):
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.rollout_cap = None
+        return engine
+
+    began = time.perf_counter()
+    wins = match(games, lambda game: main.ejw45_MonteCarlo(path=None), uncapped, seconds=seconds, start=start)
+    print('cap: rollout_cap={} won {}/{} games on 10x10 at {}s/move against rollouts played out ({:.0f}s)'.format(
+        main.ejw45_MonteCarlo.rollout_cap, wins, games, seconds, time.perf_counter() - began))
+
+
+def bench_flat(min_time):
+    """Games on 10x10 at equal time per move: two-stage nodes with progressive widening against the flat tree."""
+    seconds = 0.1
+    games = max(2, 2 * int(min_time * 5))
+    start = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+
+    def flat(game):
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.two_stage = False
+        engine.widening = None
+        return engine
+
+    began = time.perf_counter()
+    wins = match(games, lambda game: main.ejw45_MonteCarlo(path=None), flat, seconds=seconds, start=start)
+    print('flat: two-stage + widening won {}/{} games on 10x10 at {}s/move against the flat tree ({:.0f}s)'.format(
+        wins, games, seconds, time.perf_counter() - began))
+
+
+def bench_profile(min_time):
+    """What the profiler costs: playouts per second with it off and on, and the summary it gives."""
+    results = {}
+    for enabled in (False, True):
+        main.profiler.enabled = enabled
+        engine = main.ejw45_MonteCarlo(path=None)
+        engine.rollout_cap = 0
+        random.seed(0)
+        mark = main.profiler.mark()
+        calls, elapsed, _ = rate(engine.simulate, min_time)
+        results[enabled] = calls / elapsed
+        summary = main.profiler.summary(mark)
+    main.profiler.enabled = False
+
+    print('profile: playouts scored by the evaluator (rollout_cap = 0), the cheapest to instrument around')
+    print('  off {:>8.1f} playouts/sec'.format(results[False]))
+    print('  on  {:>8.1f} playouts/sec ({:+.1%})'.format(results[True], results[True] / results[False] - 1))
+    print('  stages: ' + ', '.join('{} {:.0%}'.format(name, seconds / summary['seconds'])
+                                   for name, seconds in sorted(summary['stages'].items())))
+
+
+def bench_regions(min_time):
+    """Per-move territory accounting over random games: count_areas floodfill against ejw45_RegionTracker."""
+    games = [random_game(seed) for seed in range(10)]
+    size = len(opening_config())
+    plies = sum(len(moves) for moves in games)
+
+    def replay(check):
+        for moves in games:
+            board = main.Board.from_config(opening_config())
+            tracker = board.regions
+
+            for move in moves:
+                (sr, sc), (dr, dc), (ar, ac) = [divmod(square, size) for square in move]
+                symbol = board.config[sr][sc]
+                board.config[dr][dc] = symbol
+                board.config[sr][sc] = '.'
+                board.config[ar][ac] = 'x'
+                check(board, tracker, move, symbol)
+
+    def floodfill(board, tracker, move, symbol):
+        board.count_areas()
+
+    def incremental(board, tracker, move, symbol):
+        tracker.move(move[0], move[1], move[2], symbol)
+        tracker.count_areas()
+
+    def both(board, tracker, move, symbol):
+        tracker.move(move[0], move[1], move[2], symbol)
+        assert tracker.count_areas() == board.count_areas()
+
+    replay(both)
+    old_calls, old_time, _ = rate(lambda: replay(floodfill), min_time)
+    new_calls, new_time, _ = rate(lambda: replay(incremental), min_time)
+
+    old_rate = old_calls * plies / old_time
+    new_rate = new_calls * plies / new_time
+    print('regions: {} plies from {} random games, results identical'.format(plies, len(games)))
+    print('  count_areas         {:>10,.0f} moves/sec'.format(old_rate))
+    print('  ejw45_RegionTracker {:>10,.0f} moves/sec ({:.1f}x)'.format(new_rate, new_rate / old_rate))
+
+
+# separated 6x6 positions (in perft.py's notation) where a queen with no empty square next to her
+# can only move into the square another queen leaves; the solver once left her out
+ENDGAME_POSITIONS = [
+    'qqx1xx/xxxxqx/xxqQxx/1xxxQx/Qxxx1x/xQx1x1 b',
+    '1xxxq1/1xxxxx/1xqQxQ/xqqxxQ/1xxx1x/2xxxQ w',
+    '2xqx1/2xxQx/xxxQqx/xQxQxx/qxxx2/1qx1xx b',
+]
+
+
+def endgame_brute(rays, queens, empty, memo):
+    """The most moves queens can make in empty, by searching every line of play with all of them at once."""
+    key = (queens, empty)
+    if key not in memo:
+        best = 0
+        for source in main.ejw45_squares(queens):
+            for destination in main.ejw45_squares(rays.reach(source, rays.full & ~empty)):
+                landed = (empty | (1 << source)) & ~(1 << destination)
+                moved = queens ^ (1 << source) ^ (1 << destination)
+                for arrow in main.ejw45_squares(rays.reach(destination, rays.full & ~landed)):
+                    best = max(best, 1 + endgame_brute(rays, moved, landed & ~(1 << arrow), memo))
+        memo[key] = best
+    return memo[key]
+
+
+def check_endgame(games=100, squares=8):
+    """
+    Compare ejw45_Endgame.moves with endgame_brute for each side of ENDGAME_POSITIONS and of every
+    separated position of random 6x6 games whose queens can reach at most squares empty squares.
+    :return: (sides compared, sides with queens next to each other)
+    """
+    start = main.ejw45_start_position(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'amazonsconfig6.txt'))
+    rays = main.ejw45_Rays.for_size(start.size)
+    solver = main.ejw45_Endgame(start.size)
+    memo = {}
+    compared = touching = 0
+
+    fixed = [main.ejw45_BitBoard.from_config(*perft.parse_position(text)) for text in ENDGAME_POSITIONS]
+    for seed in range(-len(fixed), games):
+        rng = random.Random(seed)
+        state = fixed[seed] if seed < 0 else start.copy()
+        while True:
+            empty = rays.full & ~state.occupied()
+            for queens in (state.white, state.black) if state.separated() else ():
+                if main.ejw45_popcount(rays.flood(queens, empty | queens) & empty) > squares:
+                    continue
+                solver.nodes = 0
+                solver.budget = float('inf')
+                assert solver.moves(queens, empty)[0] == endgame_brute(rays, queens, empty, memo), 'seed {}'.format(seed)
+                compared += 1
+                touching += any(rays.dilate(1 << square) & queens & ~(1 << square)
+                                for square in main.ejw45_squares(queens))
+
+            moves = state.moves()
+            if not moves:
+                break
+            state.apply(rng.choice(moves))
+
+    return compared, touching
+
+
+def bench_endgame(min_time):
+    """Exact margins of separated positions from random games, cold and from ejw45_Endgame's cache."""
+    positions = []
+    for seed in range(40):
+        random.seed(seed)
+        state = main.ejw45_BitBoard.from_config(opening_config(), white_to_move=True)
+        while not state.separated():
+            state.apply(random.choice(state.moves()))
+        positions.append(state)
+
+    solver = main.ejw45_Endgame.for_size(positions[0].size)
+
+    def margins():
+        return [solver.margin(state) for state in positions]
+
+    def areas():
+        results = []
+        for state in positions:
+            white_region, black_region = state.regions()
+            results.append(main.ejw45_popcount(white_region) - main.ejw45_popcount(black_region))
+        return results
+
+    main.ejw45_Endgame._cache.clear()
+    start = time.perf_counter()
+    exact = margins()
+    cold = time.perf_counter() - start
+    entries = len(main.ejw45_Endgame._cache)
+
+    calls, elapsed, _ = rate(margins, min_time)
+    differ = sum(margin != area for margin, area in zip(exact, areas()))
+    flipped = sum(main.ejw45_white_wins(margin, state.white_to_move) != main.ejw45_white_wins(area, state.white_to_move)
+                  for margin, area, state in zip(exact, areas(), positions))
+
+    print('endgame: {} separated positions from random games, {} cached groups'.format(len(positions), entries))
+    print('  cold              {:>8.2f} ms/position'.format(cold * 1000 / len(positions)))
+    print('  cached            {:>8.2f} ms/position'.format(elapsed * 1000 / (calls * len(positions))))
+    print('  margin differs from area in {}, winner in {}'.format(differ, flipped))
+
+    compared, touching = check_endgame()
+    print('  matches brute force for {} sides of 6x6 endgames, {} with queens side by side'.format(compared, touching))
+
+
+def bench_evaluate(min_time):
+    """Queen/king-distance evaluations per second: one position at a time against evaluate_batch."""
+    positions = random_positions(512)
+    evaluator = main.ejw45_Evaluator.for_size(positions[0].size)
+    boards, white_to_move = evaluator.stack(positions)
+
+    single = np.array([evaluator.evaluate(state) for state in positions])
+    assert np.allclose(single, evaluator.evaluate_batch(boards, white_to_move))
+
+    calls, elapsed, _ = rate(lambda: [evaluator.evaluate(state) for state in positions[:64]], min_time)
+    batch_calls, batch_elapsed, _ = rate(lambda: evaluator.evaluate_batch(boards, white_to_move), min_time)
+
+    single_rate = calls * 64 / elapsed
+    batch_rate = batch_calls * len(positions) / batch_elapsed
+    print('evaluate: {} random positions, single and batched values identical'.format(len(positions)))
+    print('  bitboards {:>10,.0f} evaluations/sec'.format(single_rate))
+    print('  batched   {:>10,.0f} evaluations/sec ({:.1f}x)'.format(batch_rate, batch_rate / single_rate))
+
+
+def bench_knowledge(min_time):
+    """Startup time, lookups per second and size on disk: pickled dict against ejw45_KnowledgeBase."""
+    rng = random.Random(0)
+    entries = 200000
+    table = dict((rng.getrandbits(64), (rng.randrange(100), 100)) for _ in range(entries))
+    probes = list(table)[:5000]
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'table.pickle')
+        kb_path = os.path.join(directory, 'table.kb')
+
+        with open(pickle_path, 'wb') as handle:
+            pickle.dump(table, handle)
+
+        start = time.perf_counter()
+        main.ejw45_KnowledgeBase.write(kb_path, main.ejw45_KnowledgeBase.merge(main.ejw45_KnowledgeBase(), table))
+        convert_time = time.perf_counter() - start
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as handle:
+                return pickle.load(handle)
+
+        pickle_calls, pickle_time, loaded = rate(load_pickle, min_time)
+        kb_calls, kb_time, base = rate(lambda: main.ejw45_KnowledgeBase(kb_path), min_time)
+
+        assert all(base[key] == table[key] for key in probes[:500])
+
+        dict_calls, dict_time, _ = rate(lambda: [loaded[key] for key in probes], min_time)
+        mapped_calls, mapped_time, _ = rate(lambda: [base[key] for key in probes], min_time)
+
+        print('knowledge: {:,} entries, written in {:.2f} sec'.format(entries, convert_time))
+        print('  pickle  {:>8.3f} ms to load {:>12,.0f} lookups/sec {:>5.1f} bytes/entry on disk'.format(
+            1000 * pickle_time / pickle_calls, dict_calls * len(probes) / dict_time,
+            os.path.getsize(pickle_path) / float(entries)))
+        print('  mmap    {:>8.3f} ms to load {:>12,.0f} lookups/sec {:>5.1f} bytes/entry on disk'.format(
+            1000 * kb_time / kb_calls, mapped_calls * len(probes) / mapped_time,
+            os.path.getsize(kb_path) / float(entries)))
+
+    legacy = dict((main.ejw45_Board(np.array(state.to_config())), (1, 1)) for state in random_positions(1000))
+    print('  (a pickle keyed by ejw45_Board takes {:.0f} bytes/entry)'.format(
+        len(pickle.dumps(legacy)) / float(len(legacy))))
+
+
+def bench_checkpoint(min_time):
+    """Training playouts per second against table size: no checkpoints, incremental log, full rewrites."""
+    print('checkpoint: saving every 10 playouts (playouts scored by the evaluator, rollout_cap = 0)')
+    for entries in (10000, 100000, 1000000):
+        rng = np.random.default_rng(entries)
+        records = np.zeros(entries, dtype=main.ejw45_KnowledgeBase.record)
+        records['key'] = np.sort(rng.integers(0, 2 ** 63, size=entries, dtype=np.uint64))
+        records['plays'] = 1
+
+        rates = []
+        for mode in ('none', 'incremental', 'full'):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'table.kb')
+                main.ejw45_KnowledgeBase.write(path, records)
+
+                engine = main.ejw45_MonteCarlo(path=None)
+                engine.explored = main.ejw45_Table.open(path)
+                engine.rollout_cap = 0
+
+                def train():
+                    for _ in range(10):
+                        engine.simulate()
+                    if mode == 'incremental':
+                        engine.explored.checkpoint()
+                    elif mode == 'full':
+                        engine.write_to_file(path)
+
+                calls, elapsed, _ = rate(train, min_time)
+                rates.append(calls * 10 / elapsed)
+
+        print('  {:>9,} entries: {:>8.1f} none {:>8.1f} incremental {:>8.1f} full playouts/sec'.format(
+            entries, *rates))
+
+
+def bench_symmetry(min_time):
+    """Explored table entries with plain and with canonical keys, and what each key costs to compute."""
+    print('symmetry: entries after training from the start, plain Zobrist keys against canonical keys')
+    for size in (6, 10):
+        config = 'amazonsconfig{}.txt'.format(size) if size != 10 else 'amazonsconfig.txt'
+        engine = main.ejw45_MonteCarlo(path=None, start=main.ejw45_start_position(config))
+        engine.tree_limit = None
+        random.seed(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rate(engine.simulate, min_time)
+
+        plain = set()
+        canonical = set()
+        stack = [engine.root]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                plain.add(node.key)
+                canonical.add(node.canonical)
+            stack.extend(node.children)
+        print('  {0}x{0}: {1:>6} plain, {2:>6} canonical ({3:.2f}x fewer)'.format(
+            size, len(plain), len(canonical), len(plain) / float(len(canonical))))
+
+    positions = random_positions(2000)
+    table = dict((state.canonical_key(), (1, 1)) for state in positions)
+
+    def plain_keys():
+        for state in positions:
+            state.key()
+
+    def canonical_keys():
+        for state in positions:
+            table.get(state.canonical_key())
+
+    plain_calls, plain_time, _ = rate(plain_keys, min_time)
+    canonical_calls, canonical_time, _ = rate(canonical_keys, min_time)
+    plain_cost = plain_time * 1e6 / (plain_calls * len(positions))
+    canonical_cost = canonical_time * 1e6 / (canonical_calls * len(positions))
+    print('  plain key     {:>8.2f} us (kept up to date by apply)'.format(plain_cost))
+    print('  canonical key {:>8.2f} us, with the table lookup'.format(canonical_cost))
+
+
+def bench_table(min_time):
+    """Training into a bounded transposition table: playouts/sec, occupancy, hit rate and evictions."""
+    print('table: training from the opening (playouts scored by the evaluator, rollout_cap = 0)')
+    for budget in (4 << 10, 32 << 10, None):
+        engine = main.ejw45_MonteCarlo(path=None, table_budget=budget)
+        engine.rollout_cap = 0
+        engine.tree_limit = 2000
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            calls, elapsed, _ = rate(lambda: engine.train(10), min_time)
+
+        if budget is None:
+            print('  unbounded: {:>8.1f} playouts/sec, {} entries'.format(calls * 10 / elapsed, len(engine.explored)))
+            continue
+
+        statistics = engine.explored.statistics()
+        print('  {:>5} KiB: {:>8.1f} playouts/sec, {} slots {:.0%} full, {:.0%} hits, {} evictions'.format(
+            budget >> 10, calls * 10 / elapsed, statistics['capacity'], statistics['occupancy'],
+            statistics['hit_rate'], statistics['evictions']))
+
+
+def bench_import(min_time):
+    """Wall time of a fresh interpreter importing main.py, which must not build the engine or touch files."""
+    directory = os.path.dirname(os.path.abspath(main.__file__))
+    before = sorted(os.listdir(directory))
+
+    def start():
+        subprocess.check_call([sys.executable, '-c', 'import main'], cwd=directory)
+
+    baseline_calls, baseline_time, _ = rate(lambda: subprocess.check_call([sys.executable, '-c', 'import numpy']),
+                                            min_time)
+    calls, elapsed, _ = rate(start, min_time)
+
+    assert sorted(os.listdir(directory)) == before, 'importing main changed files on disk'
+    print('import: {:.0f} ms to import main ({:.0f} ms of it starting Python and importing NumPy)'.format(
+        1000 * elapsed / calls, 1000 * baseline_time / baseline_calls))
+
+
+def bench_update(min_time):
+    """Per-move referee overhead over random games: deepcopy hand-off and validation against Board.copy and valid_move."""
+    games = [random_game(seed) for seed in range(10)]
+    size = len(opening_config())
+    plies = sum(len(moves) for moves in games)
+    moves = [[tuple(divmod(square, size) for square in move) for move in game] for game in games]
+
+    def replay(turn, tracked=True):
+        for game in moves:
+            amazons = main.Amazons.__new__(main.Amazons)
+            amazons.board = main.Board.from_config(opening_config())
+            if not tracked:
+                # the board as it was before it kept an ejw45_RegionTracker, which deepcopy would copy too
+                del amazons.board.regions
+            for move in game:
+                turn(amazons, move)
+                amazons.board.bWhite = not amazons.board.bWhite
+
+    def deepcopied(amazons, move):
+        copy.deepcopy(amazons.board)
+        src, dst, adst = move
+        board = copy.deepcopy(amazons.board)
+        # move_queen and shoot_arrow as they were, on config alone
+        assert board.valid_path(src, dst)
+        board.config[dst[0]][dst[1]] = board.config[src[0]][src[1]]
+        board.config[src[0]][src[1]] = '.'
+        assert board.valid_path(dst, adst)
+        board.config[adst[0]][adst[1]] = 'x'
+        amazons.board = board
+
+    def in_place(amazons, move):
+        amazons.board.copy()
+        assert amazons.update(move)
+
+    old_calls, old_time, _ = rate(lambda: replay(deepcopied, tracked=False), min_time)
+    new_calls, new_time, _ = rate(lambda: replay(in_place), min_time)
+
+    old_rate = old_calls * plies / old_time
+    new_rate = new_calls * plies / new_time
+    print('update: {} plies from {} random games'.format(plies, len(games)))
+    print('  deepcopy (no tracker) {:>8,.0f} moves/sec'.format(old_rate))
+    print('  copy + valid_move   {:>10,.0f} moves/sec ({:.1f}x)'.format(new_rate, new_rate / old_rate))
+
+
+BENCHMARKS = {
+    'adjudication': bench_adjudication,
+    'areas': bench_areas,
+    'cap': bench_cap,
+    'checkpoint': bench_checkpoint,
+    'decision': bench_decision,
+    'endgame': bench_endgame,
+    'evaluate': bench_evaluate,
+    'flat': bench_flat,
+    'hashing': bench_hashing,
+    'import': bench_import,
+    'knowledge': bench_knowledge,
+    'lookups': bench_lookups,
+    'movegen': bench_movegen,
+    'parallel': bench_parallel,
+    'playout': bench_playout,
+    'positions': bench_positions,
+    'prior': bench_prior,
+    'profile': bench_profile,
+    'rave': bench_rave,
+    'regions': bench_regions,
+    'rollout': bench_rollout,
+    'simulate': bench_simulate,
+    'symmetry': bench_symmetry,
+    'table': bench_table,
+    'tree': bench_tree,
+    'update': bench_update,
+    'widening': bench_widening,
+}
+
+
+def machine():
+    """What the measurements were taken on."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Print every measurement next to the baseline's. :return: the number that got worse by more than threshold"""
+    regressions = 0
+    print('compared with {}'.format(baseline['machine'].get('commit') or 'the baseline'))
+    for name in sorted(results):
+        for metric, value in sorted(results[name].items()):
+            old = baseline['results'].get(name, {}).get(metric)
+            if not old:
+                continue
+
+            change = value / old - 1
+            worse = -change if not metric.endswith('_seconds') else change
+            # times under a millisecond are all noise
+            if metric.endswith('_seconds') and abs(value - old) < 0.001:
+                worse = 0
+            flag = ''
+            if worse > threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            print('  {:<40} {:>14,.3f} {:>14,.3f} {:>+8.1%} {}'.format(name + '.' + metric, old, value, change, flag))
+    return regressions
+
+
+def run():
+    global SEED
+
+    parser = argparse.ArgumentParser(description='ejw45 engine benchmarks')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks to run: {} (default: all)'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='seconds to spend timing each measurement')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the positions and the random choices')
+    parser.add_argument('--json', help='save the measurements to this file')
+    parser.add_argument('--compare', help='a file saved with --json to check the measurements against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction a measurement may get worse by before it counts as a regression')
+    args = parser.parse_args()
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark: {}'.format(', '.join(sorted(unknown))))
+
+    SEED = args.seed
+    results = {}
+    for name in args.names or sorted(BENCHMARKS):
+        random.seed(SEED)
+        np.random.seed(SEED)
+        measured = BENCHMARKS[name](args.min_time)
+        if measured:
+            results[name] = measured
+
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump({'machine': machine(), 'min_time': args.min_time, 'seed': SEED, 'results': results},
+                      handle, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
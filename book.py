@@ -0,0 +1,118 @@
+# Build, extend and merge ejw45_bot's opening book (see main.ejw45_Book).
+#
+# Usage:
+#   python book.py build [amazonsconfig.txt] --plies 2 --seconds 60 --width 3 [--output ejw45_amazon.book]
+#   python book.py merge ejw45_amazon.book run1.book run2.book
+#   python book.py show ejw45_amazon.book
+#
+# build searches the start position with the parallel search for --seconds, keeps the --keep most
+# visited moves, and does the same for the positions after the --width most visited of those, ply
+# by ply. Positions are searched in their canonical orientation, so one entry serves all the
+# symmetric variants of a position. An existing book at --output is extended: the new searches are
+# added to its statistics, and the book is saved after every position. merge adds books together.
+# ejw45_bot plays from the book named after its knowledge base, ejw45_amazon.book.
+
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import main
+
+
+def notation(size, move):
+    """:return: move, in square numbers, as 'a3-a5/b6'"""
+    return '{}-{}/{}'.format(*[main.rc2ld(divmod(square, size)) for square in move])
+
+
+def search(engine, state, seconds):
+    """:return: (playouts, dict of move -> (wins, visits)) from a search of state, a fresh tree"""
+    engine.root = None
+    engine.reroot(state)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return engine.parallel_search(time.perf_counter() + seconds + engine.time_margin)
+
+
+def build(args):
+    book = main.ejw45_Book(args.output) if os.path.isfile(args.output) else main.ejw45_Book()
+    start = main.ejw45_start_position(args.config)
+    symmetry = main.ejw45_Symmetry.for_size(start.size)
+
+    engine = main.ejw45_MonteCarlo(path=None)
+    engine.workers = args.workers
+
+    frontier = [start]
+    for ply in range(args.plies):
+        following = {}
+        for number, state in enumerate(frontier):
+            key, t = symmetry.canonical(state)
+            canonical = symmetry.transform(state, t)
+
+            playouts, statistics = search(engine, canonical, args.seconds)
+            kept = sorted(statistics, key=lambda move: statistics[move][1], reverse=True)[:args.keep]
+            book.add(start.size, key, {move: statistics[move] for move in kept})
+            book.write(args.output)
+
+            print('ply {} position {}/{}: {} playouts, best {}'.format(
+                ply + 1, number + 1, len(frontier), playouts, notation(start.size, kept[0]) if kept else None))
+
+            for move in kept[:args.width]:
+                child = canonical.copy()
+                child.apply(move)
+                following.setdefault(child.canonical_key(), child)
+
+        frontier = list(following.values())
+
+    if engine.pool is not None:
+        engine.pool.shutdown()
+    print('{} positions in {}'.format(len(book), args.output))
+
+
+def merge(args):
+    book = main.ejw45_Book()
+    for path in args.books:
+        book.merge(main.ejw45_Book(path))
+    book.write(args.output)
+    print('{} positions in {}'.format(len(book), args.output))
+
+
+def show(args):
+    book = main.ejw45_Book(args.book)
+    for (size, key), statistics in sorted(book.positions.items()):
+        moves = sorted(statistics.items(), key=lambda item: item[1][1], reverse=True)
+        print('{}x{} {:016x}: {}'.format(size, size, key, ', '.join(
+            '{} {}/{}'.format(notation(size, move), wins, visits) for move, (wins, visits) in moves)))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Build and merge opening books for ejw45_bot')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('build', help='search the first plies of a game into a book')
+    command.add_argument('config', nargs='?', help='setup file, as for main.py (default: the standard 10x10 game)')
+    command.add_argument('--output', default=main.ejw45_MonteCarlo.book_path('ejw45_amazon.kb'),
+                         help='book to write, extended if it exists')
+    command.add_argument('--plies', type=int, default=2, help='plies from the start to search')
+    command.add_argument('--seconds', type=float, default=60.0, help='search time per position')
+    command.add_argument('--workers', type=int, default=None, help='processes per search (default: every core)')
+    command.add_argument('--keep', type=int, default=8, help='moves kept per position')
+    command.add_argument('--width', type=int, default=3, help='moves per position followed to the next ply')
+    command.set_defaults(function=build)
+
+    command = commands.add_parser('merge', help='add books together')
+    command.add_argument('output')
+    command.add_argument('books', nargs='+')
+    command.set_defaults(function=merge)
+
+    command = commands.add_parser('show', help='list the positions and moves in a book')
+    command.add_argument('book')
+    command.set_defaults(function=show)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    run()
@@ -59,18 +59,87 @@
 
 ############################################
 
-import copy
+import argparse
+import json
+import logging
 import re
 import sys
 import time
 
+# Why a move was rejected is logged at DEBUG, which nothing shows unless asked for,
+# e.g. with logging.basicConfig(level=logging.DEBUG).
+logger = logging.getLogger('amazons')
+logger.addHandler(logging.NullHandler())
+
+
+# The Profiler class holds opt-in counters and stage timers for the game controller
+# and the search. Instrumented code checks profiler.enabled before it times anything,
+# so while it is off (the default) a stage costs one attribute test.
+# When it is on, Amazons.play writes a JSON summary of every move and of every game
+# to profiler.stream, one object per line (see summary for the fields).
+# The select, expand, rollout and backpropagate stages split up each playout; movegen,
+# hashing, adjudicate and explored time parts of them, and validate and count_areas
+# are spent by the controller.
+# Turn it on with "python main.py --profile <file> <setup file>".
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.stream = sys.stderr
+        self.counts = {}
+        self.seconds = {}
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def mark(self):
+        """:return: a snapshot for summary to measure from"""
+        return time.perf_counter(), dict(self.counts), dict(self.seconds)
+
+    def summary(self, mark, **fields):
+        """:return: fields, plus what was counted and timed since mark, ready for json.dumps"""
+        start, counts_before, seconds_before = mark
+        elapsed = time.perf_counter() - start
+        counts = dict((name, value - counts_before.get(name, 0)) for name, value in self.counts.items()
+                      if value != counts_before.get(name, 0))
+        seconds = dict((name, value - seconds_before.get(name, 0.0)) for name, value in self.seconds.items()
+                       if value != seconds_before.get(name, 0.0))
+
+        playouts = counts.get('playouts', 0)
+        rollouts = counts.get('rollouts', 0)
+        lookups = counts.get('table_lookups', 0)
+
+        summary = dict(fields)
+        summary.update({
+            'seconds': elapsed,
+            'playouts': playouts,
+            'playouts_per_sec': playouts / elapsed if elapsed else 0.0,
+            'nodes': counts.get('nodes', 0),
+            'mean_rollout_plies': counts.get('rollout_plies', 0) / float(rollouts) if rollouts else 0.0,
+            'table_hit_rate': counts.get('table_hits', 0) / float(lookups) if lookups else 0.0,
+            'counts': counts,
+            'stages': seconds,
+        })
+        return summary
+
+    def emit(self, summary):
+        self.stream.write(json.dumps(summary, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+profiler = Profiler()
+
 
 # The Amazons class controls the flow of the game.
 # Its data include:
 # * size -- size of board: assume it's <= 10
 # * time_limit -- # of seconds a mchine is allowed to take (<30)
-# * playerW -- name of the player function who'll play white
+# * playerW -- name of the player function who'll play white (see players)
 # * playerB -- name of the player function who'll play black
+# * quiet -- if True, play prints nothing (for running many games unattended)
+# * turns -- (player, seconds, move accepted) for every turn played so far
 # * wqs -- initial positions of the white queens
 # * bqs -- initial positions of the black queens
 # * board -- current board configuration (see class def for Board)
@@ -80,14 +149,18 @@ import time
 #   - check for the validity of the player's move:
 #     an auto player loses a turn if an invalid move is returned or if it didn't return a move in the alloted time
 #   - check for end game condition
-#   - declare the winner
-# * update: this function tries out the move on a temporary board.
+#   - declare the winner, and return the final (wscore, bscore)
+# * update: this function checks the move against the board in place.
 #   if the move is valid, the real board will be updated.
 # * end_turn: just get the score from the board class
+# With profiler.enabled, play writes a JSON summary of each move and of the game,
+# and update and Board.end_turn time move validation and count_areas.
 
 
 class Amazons:
-    def __init__(self, fname):
+    def __init__(self, fname, quiet=False):
+        self.quiet = quiet
+        self.turns = []
         fin = open(fname, 'r')
         self.time_limit = int(fin.readline())
         self.size = int(fin.readline())
@@ -103,37 +176,45 @@ class Amazons:
         except:
             return False
 
-        # try out the move on a temp board
-        tmp_board = copy.deepcopy(self.board)
-        if tmp_board.valid_path(src, dst):
-            tmp_board.move_queen(src, dst)
-            if tmp_board.valid_path(dst, adst):
-                # the move is good. make the real board point to it
-                tmp_board.shoot_arrow(adst)
-                del self.board
-                self.board = tmp_board
-                return True
-        # move failed.
-        del tmp_board
-        return False
+        if profiler.enabled:
+            start = time.perf_counter()
+            valid = self.board.valid_move(src, dst, adst)
+            profiler.add('validate', time.perf_counter() - start)
+        else:
+            valid = self.board.valid_move(src, dst, adst)
+
+        if not valid:
+            return False
+        # the move is good. play it on the real board
+        self.board.move_queen(src, dst)
+        self.board.shoot_arrow(adst)
+        return True
 
     def end_turn(self):
         return self.board.end_turn()
 
+    def report(self, *args):
+        if not self.quiet:
+            print(*args)
+
     def play(self):
         bPlay = True
         wscore = bscore = 0
+        if profiler.enabled:
+            game_mark = profiler.mark()
         while (bPlay):
             for p in [self.playerW, self.playerB]:
+                if profiler.enabled:
+                    move_mark = profiler.mark()
                 # send player a copy of the current board
-                tmp_board = copy.deepcopy(self.board)
-                tstart = time.clock()
+                tmp_board = self.board.copy()
+                tstart = time.perf_counter()
                 tmp_board.time_limit = tstart + self.time_limit
-                move = eval("%s(tmp_board)" % p)
-                tstop = time.clock()
+                move = find_player(p)(tmp_board)
+                tstop = time.perf_counter()
                 del tmp_board
 
-                print(p, ": move:", move, "time:", tstop - tstart, "seconds")
+                self.report(p, ": move:", move, "time:", tstop - tstart, "seconds")
                 if not move:
                     # if move == False --> player resigned
                     if self.board.bWhite:
@@ -145,28 +226,40 @@ class Amazons:
 
                 # only keep clock for auto players
                 if p != "human" and (tstop - tstart) > self.time_limit:
-                    print(p, ": took too long -- lost a turn")
+                    self.report(p, ": took too long -- lost a turn")
+                    self.turns.append((p, tstop - tstart, False))
                 elif not self.update(move):
-                    print(p, ": invalid move", move, " lost a turn")
+                    self.report(p, ": invalid move", move, " lost a turn")
+                    self.turns.append((p, tstop - tstart, False))
+                else:
+                    self.turns.append((p, tstop - tstart, True))
 
                 # at the end of the turn, check whether the game ended
                 # and update whether white is playing next
                 (wscore, bscore) = self.end_turn()
+                if profiler.enabled:
+                    profiler.emit(profiler.summary(move_mark, kind='move', player=p, ply=len(self.turns),
+                                                   accepted=self.turns[-1][2]))
                 if wscore and bscore:
                     continue
                 else:
                     bPlay = False
                     break
+        if profiler.enabled:
+            profiler.emit(profiler.summary(game_mark, kind='game', white=self.playerW, black=self.playerB,
+                                           plies=len(self.turns), wscore=wscore, bscore=bscore))
         # print final board
-        self.board.print_board()
+        if not self.quiet:
+            self.board.print_board()
         if wscore == -1:
-            print(self.playerW, "(white) resigned.", self.playerB, "(black) wins")
+            self.report(self.playerW, "(white) resigned.", self.playerB, "(black) wins")
         elif bscore == -1:
-            print(self.playerB, "(black) resigned.", self.playerW, "(white) wins")
+            self.report(self.playerB, "(black) resigned.", self.playerW, "(white) wins")
         elif not wscore:
-            print(self.playerB, "(black) wins by a margin of", bscore)
+            self.report(self.playerB, "(black) wins by a margin of", bscore)
         else:
-            print(self.playerW, "(white) wins by a margin of", wscore)
+            self.report(self.playerW, "(white) wins by a margin of", wscore)
+        return (wscore, bscore)
 
 
 ##############################################
@@ -184,10 +277,18 @@ class Amazons:
 #    The assumed convention is (row, column) so config[0][1] = "b0"
 #  * bWhite: binary indicator -- True if it's white's turn to play
 #  * time_limit: deadline by which an auto move has to be made
+#  * regions: the empty regions of config (an ejw45_RegionTracker), kept up to date
+#    by move_queen and shoot_arrow so that end_turn does not flood fill the board again
 # The Board class supports the following methods:
+#  * from_config: builds a board from a config and the side to move; use it rather than
+#    assigning config, which would leave regions describing the old one
+#  * copy: returns an independent copy of the board (what the players are handed)
 #  * print_board: prints the current board configuration
 #  * valid_path: takes two location tuples (in row, column format) and returns
 #    whether the end points describe a valid path (for either the queen or the arrow)
+#  * path_problem: the same check, returning why the path is invalid, or None
+#  * valid_move: takes the three location tuples of a move and returns whether
+#    the queen path and then the arrow path are valid, leaving the board as it was
 #  * move_queen: takes two location tuples (in row, column format)
 #    and updates the board configuration to reflect the queen moving
 #    from src to dst
@@ -195,7 +296,7 @@ class Amazons:
 #    and updates the board configuration to include the shot arrow
 #  * end_turn: This function does some end of turn accounting: update whose
 #    turn it is and determine whether the game ended
-#  * count_areas: This is a helper function for end_turn. It figures out
+#  * count_areas: This is the reference floodfill for regions.count_areas. It figures out
 #    whether we can end the game. This function has a known bug: for special
 #    small "defective regions" -- for example:
 #
@@ -211,6 +312,7 @@ class Amazons:
 #    (Muller and Tegos, 2002). For practical uses of declarining a winner,
 #    the area counting program should be sufficient. We can always have
 #    your players fight to the bitter end if the margin of win is close.
+#    (ejw45_Endgame counts such regions exactly for the bot, by search.)
 #
 class Board:
     def __init__(self, size, wqs, bqs):
@@ -221,6 +323,25 @@ class Board:
             self.config[r][c] = 'Q'
         for (r, c) in bqs:
             self.config[r][c] = 'q'
+        self.regions = ejw45_RegionTracker.from_config(self.config)
+
+    @classmethod
+    def from_config(cls, config, white_to_move=True):
+        """A board set up as config, with its regions worked out to match; assigning config would leave them stale."""
+        board = cls.__new__(cls)
+        board.bWhite = white_to_move
+        board.time_limit = None
+        board.config = [list(row) for row in config]
+        board.regions = ejw45_RegionTracker.from_config(board.config)
+        return board
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.bWhite = self.bWhite
+        board.time_limit = self.time_limit
+        board.config = [row[:] for row in self.config]
+        board.regions = self.regions.copy()
+        return board
 
     def print_board(self):
         size = len(self.config)
@@ -232,26 +353,25 @@ class Board:
         print(tmp)
         print("     White")
 
-    def valid_path(self, src, dst):
+    def path_problem(self, src, dst):
+        """:return: why src to dst is not a valid path for the side to move's queen or arrow, or None if it is"""
         (srcr, srcc) = src
         (dstr, dstc) = dst
 
-        srcstr = rc2ld(src)
-        dststr = rc2ld(dst)
+        size = len(self.config)
+        if not (0 <= srcr < size and 0 <= srcc < size and 0 <= dstr < size and 0 <= dstc < size):
+            return "off the board: {} {}".format(src, dst)
 
         symbol = self.config[srcr][srcc]
         if (self.bWhite and symbol != 'Q') or (not self.bWhite and symbol != 'q'):
-            print("invalid move: cannot find queen at src:", srcstr)
-            return False
+            return "cannot find queen at src: {}".format(rc2ld(src))
 
         h = dstr - srcr
         w = dstc - srcc
-        if h and w and abs(h / w) != 1:
-            print("invalid move: not a straight line")
-            return False
+        if h and w and abs(h) != abs(w):
+            return "not a straight line"
         if not h and not w:
-            print("invalid move: same star-end")
-            return False
+            return "same star-end"
 
         if not h:
             op = (0, int(w / abs(w)))
@@ -264,20 +384,51 @@ class Board:
         while (r, c) != (dstr, dstc):
             (r, c) = (r + op[0], c + op[1])
             if (self.config[r][c] != '.'):
-                print("invalid move: the path is not cleared between", srcstr, dststr)
-                return False
+                return "the path is not cleared between {} {}".format(rc2ld(src), rc2ld(dst))
+        return None
+
+    def valid_path(self, src, dst):
+        problem = self.path_problem(src, dst)
+        if problem is not None:
+            logger.debug("invalid move: %s", problem)
+            return False
         return True
 
+    def valid_move(self, src, dst, adst):
+        if not self.valid_path(src, dst):
+            return False
+
+        # the arrow flies from dst with the queen already off src; move it
+        # on config only for the check, and put it back either way
+        config = self.config
+        symbol = config[src[0]][src[1]]
+        config[src[0]][src[1]] = '.'
+        config[dst[0]][dst[1]] = symbol
+        valid = self.valid_path(dst, adst)
+        config[dst[0]][dst[1]] = '.'
+        config[src[0]][src[1]] = symbol
+        return valid
+
     def move_queen(self, src, dst):
-        self.config[dst[0]][dst[1]] = self.config[src[0]][src[1]]
+        size = len(self.config)
+        symbol = self.config[src[0]][src[1]]
+        self.config[dst[0]][dst[1]] = symbol
         self.config[src[0]][src[1]] = '.'
+        self.regions.vacate(src[0] * size + src[1])
+        self.regions.occupy(dst[0] * size + dst[1], symbol)
 
     def shoot_arrow(self, dst):
         self.config[dst[0]][dst[1]] = 'x'
+        self.regions.occupy(dst[0] * len(self.config) + dst[1], 'x')
 
     def end_turn(self):
         # count up each side's territories
-        (w, b) = self.count_areas()
+        if profiler.enabled:
+            start = time.perf_counter()
+            (w, b) = self.regions.count_areas()
+            profiler.add('count_areas', time.perf_counter() - start)
+        else:
+            (w, b) = self.regions.count_areas()
         # if none of the queens of either side can move, the player who just
         # played wins, since that player claimed the last free space.
         if b == w and b == 0:
@@ -373,12 +524,31 @@ def rc2ld(tup_loc):
     return chr(tup_loc[1] + ord('a')) + str(tup_loc[0])
 
 
+# players -- the player functions a game can be set up with, by name.
+# Add your automatic player with register_player; find_player only knows the
+# registered ones.
+
+players = {}
+
+
+def register_player(function):
+    players[function.__name__] = function
+    return function
+
+
+def find_player(name):
+    if name not in players:
+        raise ValueError('unknown player {!r}; the players are {}'.format(name, ', '.join(sorted(players))))
+    return players[name]
+
+
 # get next move from a human player
 # The possible return values are the same as an automatic player:
 # Usually, the next move should be returned. It must be specified in the following format:
 # [(queen-start-row, queen-start-col), (queen-end-row,queen-end-col), (arrow-end-row, arrow-end-col)]
 # To resign from the game, return False
 
+@register_player
 def human(board):
     board.print_board()
 
@@ -401,9 +571,11 @@ def human(board):
             else:
                 print(str(raw_move), "is not a valid input format")
         (src, dst) = map(ld2rc, raw_move[0].split('-'))
-        if board.valid_path(src, dst):
+        problem = board.path_problem(src, dst)
+        if problem is None:
             board.move_queen(src, dst)
             break
+        print("invalid move:", problem)
 
     board.print_board()
     print("Options:")
@@ -419,15 +591,19 @@ def human(board):
             else:
                 print(raw_move, "is not a valid input")
         adst = ld2rc(raw_move)
-        if board.valid_path(dst, adst):
+        problem = board.path_problem(dst, adst)
+        if problem is None:
             return (src, dst, adst)
+        print("invalid shot:", problem)
 
 
 ###################### Your code between these two comment lines ####################################
+import concurrent.futures
 import os
 import random
 import numpy as np
 import pickle
+import struct
 from math import log, sqrt
 
 
@@ -436,7 +612,7 @@ class ejw45_Board:
         self.board = np.array(board)
         self.player_symbols = {True: 'Q', False: 'q'}
 
-    def moves(self, player):
+    def moves(self, is_white):
         """
         :param is_white: if the player in question is white or black
         :return: a set of all possible moves in the form of (queen_start, queen_end, arrow)
@@ -444,7 +620,7 @@ class ejw45_Board:
         boards = []
         moves = []
 
-        queen_moves = self.queen_moves(player.white)
+        queen_moves = self.queen_moves(is_white)
 
         for queen_move in queen_moves:
             source, destination = queen_move
@@ -458,40 +634,11 @@ class ejw45_Board:
 
         return boards, moves
 
-    def get_spot(self, start_position, direction):
-        height, width = self.board.shape
-        r, c = start_position
-
-        r -= direction.count('n')
-        r += direction.count('s')
-        c += direction.count('e')
-        c -= direction.count('w')
-
-        if 0 <= r < height and 0 <= c < width:
-            return self.board[r, c], (r, c)
-        else:
-            return 'X', (r, c)
-
     def position_moves(self, spot):
-        directions = ['n', 'ne', 'e', 'se', 's', 'sw', 'w', 'nw']
-        moves = []
-
-        for direction in directions:
-            location = spot
-            dir = direction
-
-            obstruction = False
-
-            while not obstruction:
-                piece, new_spot = self.get_spot(location, dir)
-
-                if piece == '.':
-                    moves.append((spot, new_spot))
-                    dir += direction
-                else:
-                    obstruction = True
-
-        return moves
+        size = self.board.shape[0]
+        rays = ejw45_Rays.for_size(size)
+        r, c = spot
+        return [(spot, divmod(square, size)) for square in rays.walk(r * size + c, self.board.ravel().tolist())]
 
     def queen_moves(self, is_white):
         moves = []
@@ -521,178 +668,2430 @@ class ejw45_Board:
         copy[dst] = 'x'
         return ejw45_Board(copy)
 
+    def key(self):
+        """The Zobrist key of the equivalent ejw45_BitBoard, computed once per board."""
+        if getattr(self, 'zobrist_key', None) is None:
+            self.zobrist_key = ejw45_BitBoard.from_config(self.board).key()
+        return self.zobrist_key
+
     def __eq__(x, y):
-        return np.array_equal(x.board, y.board)
+        return x.key() == y.key() and np.array_equal(x.board, y.board)
 
     def __hash__(self):
-        return hash(str(self.board))
+        return self.key()
+
+
+class ejw45_Rays:
+    """
+    Rays for a square board of a given size, computed once per size: as flat tables of the
+    squares along each ray, and as bitboard masks.
+
+    Squares are numbered row-major (square = row * size + column), so bit n of
+    a bitboard is config[n // size][n % size].
+    """
+    directions = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+
+    _cache = {}
+
+    def __init__(self, size):
+        self.size = size
+        self.squares = size * size
+        self.full = (1 << self.squares) - 1
+
+        # the ray from square in direction d is line_squares[line_start[i]:line_start[i + 1]]
+        # with i = square * 8 + d, nearest square first
+        self.line_start = [0]
+        self.line_squares = []
+        for square in range(self.squares):
+            for dr, dc in self.directions:
+                r, c = divmod(square, size)
+                r, c = r + dr, c + dc
+                while 0 <= r < size and 0 <= c < size:
+                    self.line_squares.append(r * size + c)
+                    r, c = r + dr, c + dc
+                self.line_start.append(len(self.line_squares))
+
+        # masks[d][square] holds every square in direction d from square (excluding itself)
+        self.masks = [[sum(1 << target for target in self.line(square, d)) for square in range(self.squares)]
+                      for d in range(8)]
+        # ascending[d] is True when square numbers grow along direction d
+        self.ascending = [dr * size + dc > 0 for dr, dc in self.directions]
+
+        # used to stop king steps from wrapping around the board's edges
+        first_column = sum(1 << (r * size) for r in range(size))
+        self.not_first_column = self.full ^ first_column
+        self.not_last_column = self.full ^ (first_column << (size - 1))
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._cache:
+            cls._cache[size] = cls(size)
+        return cls._cache[size]
+
+    def line(self, square, d):
+        """:return: the squares in direction d from square, nearest first"""
+        i = square * 8 + d
+        return self.line_squares[self.line_start[i]:self.line_start[i + 1]]
+
+    def walk(self, square, cells):
+        """
+        :param cells: the board's symbols, flattened row-major ('.' is empty)
+        :return: list of every empty square reachable in a straight line from square
+        """
+        line_start, line_squares = self.line_start, self.line_squares
+        reachable = []
+        for i in range(square * 8, square * 8 + 8):
+            for j in range(line_start[i], line_start[i + 1]):
+                target = line_squares[j]
+                if cells[target] != '.':
+                    break
+                reachable.append(target)
+        return reachable
+
+    def reach(self, square, occupied):
+        """
+        :param square: the square a queen or arrow starts from
+        :param occupied: bitboard of every queen and arrow on the board
+        :return: bitboard of every empty square reachable in a straight line from square
+        """
+        reachable = 0
+        for masks, ascending in zip(self.masks, self.ascending):
+            ray = masks[square]
+            blockers = ray & occupied
+
+            if blockers:
+                # cut the ray off at the nearest blocker
+                if ascending:
+                    nearest = (blockers & -blockers).bit_length() - 1
+                else:
+                    nearest = blockers.bit_length() - 1
+                ray ^= masks[nearest] | (1 << nearest)
+
+            reachable |= ray
+        return reachable
+
+    def dilate(self, bitboard):
+        """:return: bitboard grown by one king step in every direction"""
+        grown = bitboard | ((bitboard & self.not_last_column) << 1) | ((bitboard & self.not_first_column) >> 1)
+        return (grown | (grown << self.size) | (grown >> self.size)) & self.full
+
+    def flood(self, seeds, empty):
+        """:return: every square of empty connected to seeds by king steps through empty"""
+        region = 0
+        frontier = self.dilate(seeds) & empty
+        while frontier:
+            region |= frontier
+            frontier = self.dilate(frontier) & empty & ~region
+        return region
+
+
+class ejw45_Zobrist:
+    """
+    64-bit Zobrist keys for a board size. The tables come from a fixed seed so that
+    keys stay valid across runs and can be stored on disk.
+    """
+    seed = 45
+
+    _cache = {}
+
+    def __init__(self, size):
+        rng = random.Random('{}:{}'.format(self.seed, size))
+        squares = size * size
+
+        self.white = [rng.getrandbits(64) for _ in range(squares)]
+        self.black = [rng.getrandbits(64) for _ in range(squares)]
+        self.arrows = [rng.getrandbits(64) for _ in range(squares)]
+        # folded in whenever white is to move
+        self.white_to_move = rng.getrandbits(64)
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._cache:
+            cls._cache[size] = cls(size)
+        return cls._cache[size]
+
+    def key(self, white, black, arrows, white_to_move):
+        """Compute a key from scratch; ejw45_BitBoard keeps its own key up to date incrementally."""
+        key = self.white_to_move if white_to_move else 0
+        for bitboard, table in ((white, self.white), (black, self.black), (arrows, self.arrows)):
+            for square in ejw45_squares(bitboard):
+                key ^= table[square]
+        return key
+
+
+class ejw45_Symmetry:
+    """
+    The 8 symmetries of a square board, its rotations and reflections, under which every position
+    plays the same. permutations[t][square] is where symmetry t takes square (0 is the identity)
+    and inverses[t] takes it back.
+
+    The Zobrist tables of all 8 orientations are packed side by side into 512-bit integers, so one
+    pass over the pieces gives the key of every orientation at once. The smallest of them is the
+    position's canonical key, shared by all its symmetric variants.
+    """
+    _cache = {}
+
+    def __init__(self, size):
+        self.size = size
+        squares = size * size
+        last = size - 1
+
+        self.permutations = []
+        for transpose in (False, True):
+            for flip_rows in (False, True):
+                for flip_columns in (False, True):
+                    permutation = []
+                    for square in range(squares):
+                        r, c = divmod(square, size)
+                        if transpose:
+                            r, c = c, r
+                        if flip_rows:
+                            r = last - r
+                        if flip_columns:
+                            c = last - c
+                        permutation.append(r * size + c)
+                    self.permutations.append(permutation)
+
+        self.inverses = []
+        for permutation in self.permutations:
+            inverse = [0] * squares
+            for square, image in enumerate(permutation):
+                inverse[image] = square
+            self.inverses.append(inverse)
+
+        zobrist = ejw45_Zobrist.for_size(size)
+
+        def packed(table):
+            return [sum(table[permutation[square]] << (64 * t) for t, permutation in enumerate(self.permutations))
+                    for square in range(squares)]
+
+        self.white = packed(zobrist.white)
+        self.black = packed(zobrist.black)
+        self.arrows = packed(zobrist.arrows)
+        self.white_to_move = sum(zobrist.white_to_move << (64 * t) for t in range(8))
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._cache:
+            cls._cache[size] = cls(size)
+        return cls._cache[size]
+
+    def keys(self, state):
+        """:return: the Zobrist keys of state under each of the 8 symmetries"""
+        key = self.white_to_move if state.white_to_move else 0
+        for bitboard, table in ((state.white, self.white), (state.black, self.black), (state.arrows, self.arrows)):
+            for square in ejw45_squares(bitboard):
+                key ^= table[square]
+        return [(key >> (64 * t)) & 0xFFFFFFFFFFFFFFFF for t in range(8)]
+
+    def canonical(self, state):
+        """:return: (the canonical key of state, a symmetry taking state to an orientation with that key)"""
+        keys = self.keys(state)
+        key = min(keys)
+        return key, keys.index(key)
+
+    def transform(self, state, t):
+        """:return: a new ejw45_BitBoard with state's pieces moved by symmetry t"""
+        permutation = self.permutations[t]
+
+        def moved(bitboard):
+            result = 0
+            for square in ejw45_squares(bitboard):
+                result |= 1 << permutation[square]
+            return result
+
+        return ejw45_BitBoard(self.size, moved(state.white), moved(state.black), moved(state.arrows),
+                              state.white_to_move)
+
+    def restore_move(self, move, t):
+        """:return: move, played on a board transformed by symmetry t, as played on the original board"""
+        inverse = self.inverses[t]
+        return tuple(inverse[square] for square in move)
+
+
+def ejw45_popcount(bitboard):
+    return bin(bitboard).count('1')
+
+
+def ejw45_white_wins(margin, white_to_move):
+    """
+    Decide a game from white's territory margin. On equal territory the side to move
+    runs out of moves first.
+    """
+    return margin > 0 or (margin == 0 and not white_to_move)
+
+
+def ejw45_squares(bitboard):
+    """Yield the square number of every set bit, lowest first."""
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+def ejw45_nth_square(bitboard, n):
+    """:return: the square number of the set bit with n set bits below it"""
+    for _ in range(n):
+        bitboard &= bitboard - 1
+    return (bitboard & -bitboard).bit_length() - 1
+
+
+class ejw45_BitBoard:
+    """
+    Compact game state: one integer bitboard each for the white queens, the black queens
+    and the arrows, plus the side to move.
+
+    Moves are (queen_start, queen_end, arrow) triples of square numbers and are played
+    in place with apply / undo, which also keep the Zobrist key of the position up to date.
+    """
+    __slots__ = ('size', 'rays', 'zobrist', 'white', 'black', 'arrows', 'white_to_move', 'hash_key')
+
+    def __init__(self, size, white=0, black=0, arrows=0, white_to_move=True, hash_key=None):
+        self.size = size
+        self.rays = ejw45_Rays.for_size(size)
+        self.zobrist = ejw45_Zobrist.for_size(size)
+        self.white = white
+        self.black = black
+        self.arrows = arrows
+        self.white_to_move = white_to_move
+
+        if hash_key is None:
+            hash_key = self.zobrist.key(white, black, arrows, white_to_move)
+        self.hash_key = hash_key
+
+    @classmethod
+    def from_config(cls, config, white_to_move=None):
+        """
+        :param config: a Board.config style grid of 'Q', 'q', 'x' and '.'
+        :param white_to_move: side to move; when None it is inferred from the arrow count,
+                              since white moves first and every move shoots one arrow
+        """
+        size = len(config)
+        white = black = arrows = 0
+
+        for r in range(size):
+            for c in range(size):
+                bit = 1 << (r * size + c)
+                symbol = config[r][c]
+
+                if symbol == 'Q':
+                    white |= bit
+                elif symbol == 'q':
+                    black |= bit
+                elif symbol == 'x':
+                    arrows |= bit
+
+        if white_to_move is None:
+            white_to_move = bin(arrows).count('1') % 2 == 0
+
+        return cls(size, white, black, arrows, white_to_move)
+
+    def to_config(self):
+        config = [['.' for c in range(self.size)] for r in range(self.size)]
+
+        for bitboard, symbol in ((self.white, 'Q'), (self.black, 'q'), (self.arrows, 'x')):
+            for square in ejw45_squares(bitboard):
+                r, c = divmod(square, self.size)
+                config[r][c] = symbol
+
+        return config
+
+    def copy(self):
+        return ejw45_BitBoard(self.size, self.white, self.black, self.arrows, self.white_to_move, self.hash_key)
+
+    def location(self, square):
+        return divmod(square, self.size)
+
+    def to_move(self, move):
+        """Translate a move of square numbers into the ((r, c), (r, c), (r, c)) format used by Amazons."""
+        return tuple(self.location(square) for square in move)
+
+    def occupied(self):
+        return self.white | self.black | self.arrows
+
+    def queens(self, is_white):
+        return self.white if is_white else self.black
+
+    def arrow_moves(self, source, destination):
+        """:return: bitboard of every square the queen moved from source to destination can shoot to"""
+        occupied = self.occupied() ^ (1 << source) | (1 << destination)
+        return self.rays.reach(destination, occupied)
+
+    def iter_moves(self):
+        """
+        Lazily yield every legal (queen_start, queen_end, arrow) move for the side to move.
+        The board may be changed by apply while iterating as long as it is undone before the next move is drawn.
+        """
+        occupied = self.occupied()
+        reach = self.rays.reach
+
+        for source in ejw45_squares(self.queens(self.white_to_move)):
+            # the queen's start square is free for the arrow once she has moved
+            vacated = occupied ^ (1 << source)
+
+            for destination in ejw45_squares(reach(source, occupied)):
+                for arrow in ejw45_squares(reach(destination, vacated | (1 << destination))):
+                    yield source, destination, arrow
+
+    def moves(self):
+        """
+        :return: a list of every legal (queen_start, queen_end, arrow) move for the side to move
+        """
+        return list(self.iter_moves())
+
+    def random_move(self):
+        """
+        Pick one of the side to move's queen moves uniformly, then one of the moved queen's arrow
+        squares uniformly, as ejw45_BatchPlayout does, without listing the moves.
+        :return: a (queen_start, queen_end, arrow) move, or None if the side to move cannot move
+        """
+        occupied = self.occupied()
+        reach = self.rays.reach
+
+        reaches = [(source, reach(source, occupied)) for source in ejw45_squares(self.queens(self.white_to_move))]
+        counts = [ejw45_popcount(destinations) for _, destinations in reaches]
+        pick = sum(counts)
+        if not pick:
+            return None
+
+        pick = random.randrange(pick)
+        for (source, destinations), count in zip(reaches, counts):
+            if pick < count:
+                break
+            pick -= count
+        destination = ejw45_nth_square(destinations, pick)
+
+        # the start square is free for the arrow, so every queen move has one
+        arrows = reach(destination, occupied ^ (1 << source) | (1 << destination))
+        return source, destination, ejw45_nth_square(arrows, random.randrange(ejw45_popcount(arrows)))
+
+    def regions(self):
+        """
+        :return: (white region, black region): the empty squares each side's queens can still reach.
+                 The queens are walled off from each other once the two regions are disjoint.
+        """
+        empty = self.rays.full & ~self.occupied()
+        return self.rays.flood(self.white, empty), self.rays.flood(self.black, empty)
+
+    def separated(self):
+        """
+        :return: True once no empty square can be reached by queens of both sides. This floods
+                 out from the white queens and stops as soon as it touches a black queen's square,
+                 so it is cheap while the queens are still mixed.
+        """
+        dilate = self.rays.dilate
+        empty = self.rays.full & ~self.occupied()
+        black_border = dilate(self.black) & empty
+
+        region = 0
+        frontier = dilate(self.white) & empty
+        while frontier:
+            if frontier & black_border:
+                return False
+            region |= frontier
+            frontier = dilate(frontier) & empty & ~region
+        return True
+
+    def apply(self, move):
+        source, destination, arrow = move
+        step = (1 << source) | (1 << destination)
+        zobrist = self.zobrist
+
+        if self.white_to_move:
+            self.white ^= step
+            queens = zobrist.white
+        else:
+            self.black ^= step
+            queens = zobrist.black
+
+        self.arrows |= 1 << arrow
+        self.white_to_move = not self.white_to_move
+        self.hash_key ^= queens[source] ^ queens[destination] ^ zobrist.arrows[arrow] ^ zobrist.white_to_move
+
+    def undo(self, move):
+        source, destination, arrow = move
+        zobrist = self.zobrist
+        self.white_to_move = not self.white_to_move
+        self.arrows ^= 1 << arrow
+
+        step = (1 << source) | (1 << destination)
+        if self.white_to_move:
+            self.white ^= step
+            queens = zobrist.white
+        else:
+            self.black ^= step
+            queens = zobrist.black
+
+        self.hash_key ^= queens[source] ^ queens[destination] ^ zobrist.arrows[arrow] ^ zobrist.white_to_move
+
+    def key(self):
+        """The 64-bit Zobrist key of the position, used to index ejw45_MonteCarlo.explored."""
+        return self.hash_key
+
+    def canonical_key(self):
+        """:return: the key shared by this position and its rotations and reflections (see ejw45_Symmetry)"""
+        return ejw45_Symmetry.for_size(self.size).canonical(self)[0]
+
+    def __eq__(self, other):
+        return (self.white == other.white and self.black == other.black and
+                self.arrows == other.arrows and self.white_to_move == other.white_to_move)
+
+    def __hash__(self):
+        return self.hash_key
+
+
+class ejw45_Region:
+    """A king-connected region of empty squares and the queens of each side that border it."""
+    __slots__ = ('squares', 'white', 'black')
+
+    def __init__(self, squares, white, black):
+        self.squares = squares
+        self.white = white
+        self.black = black
+
+
+class ejw45_RegionTracker:
+    """
+    The empty squares of a board split into ejw45_Regions, kept up to date as squares are
+    filled and emptied. Only the regions next to a changed square are re-split, instead of
+    flood filling the whole board as Board.count_areas does.
+    """
+
+    def __init__(self, size, white, black, arrows):
+        self.rays = ejw45_Rays.for_size(size)
+        self.white = white
+        self.black = black
+        self.arrows = arrows
+        self.regions = self.split(self.rays.full & ~(white | black | arrows))
+
+    @classmethod
+    def from_config(cls, config):
+        state = ejw45_BitBoard.from_config(config)
+        return cls(state.size, state.white, state.black, state.arrows)
+
+    def copy(self):
+        # regions are replaced, never changed, so the copies can share them
+        tracker = ejw45_RegionTracker.__new__(ejw45_RegionTracker)
+        tracker.rays = self.rays
+        tracker.white = self.white
+        tracker.black = self.black
+        tracker.arrows = self.arrows
+        tracker.regions = list(self.regions)
+        return tracker
+
+    def split(self, squares):
+        """:return: the squares as a list of ejw45_Regions"""
+        regions = []
+        while squares:
+            seed = squares & -squares
+            region = self.rays.flood(seed, squares) | seed
+            squares ^= region
+
+            border = self.rays.dilate(region)
+            regions.append(ejw45_Region(region, self.white & border, self.black & border))
+        return regions
+
+    def resplit(self, touching, added=0, removed=0):
+        """Re-split the regions that meet touching, after adding and removing empty squares."""
+        kept = []
+        merged = added
+        for region in self.regions:
+            if region.squares & touching:
+                merged |= region.squares
+            else:
+                kept.append(region)
+
+        self.regions = kept + self.split(merged & ~removed)
+
+    def occupy(self, square, symbol):
+        """Fill an empty square with a queen ('Q' or 'q') or an arrow ('x')."""
+        bit = 1 << square
+        if symbol == 'Q':
+            self.white |= bit
+        elif symbol == 'q':
+            self.black |= bit
+        else:
+            self.arrows |= bit
+
+        # every empty neighbour of the square shares its region
+        self.resplit(bit, removed=bit)
+
+    def vacate(self, square):
+        """Empty a square holding a queen or an arrow."""
+        bit = 1 << square
+        self.white &= ~bit
+        self.black &= ~bit
+        self.arrows &= ~bit
+
+        self.resplit(self.rays.dilate(bit), added=bit)
+
+    def move(self, source, destination, arrow, symbol):
+        self.vacate(source)
+        self.occupy(destination, symbol)
+        self.occupy(arrow, 'x')
+
+    def areas(self):
+        """:return: (white, black, neutral) squares, as the regions' sizes are totalled by count_areas"""
+        white = black = neutral = 0
+        for region in self.regions:
+            if region.white and region.black:
+                neutral += ejw45_popcount(region.squares)
+            elif region.white:
+                white += ejw45_popcount(region.squares)
+            elif region.black:
+                black += ejw45_popcount(region.squares)
+        return white, black, neutral
+
+    def separated(self):
+        return not any(region.white and region.black for region in self.regions)
+
+    def count_areas(self):
+        """The same result as Board.count_areas."""
+        wtot, btot, ntot = self.areas()
+
+        if ntot == 0:  # no neutral space left -- should end game
+            if wtot > btot:
+                return (wtot - btot, 0)
+            else:
+                return (0, btot - wtot)
+        else:
+            return (wtot + ntot, btot + ntot)
+
+
+class ejw45_Endgame:
+    """
+    Exact play once the queens are walled off from each other. Each side then only fills its own
+    regions, and the most moves it can make is found by a memoized depth-first search over the
+    groups of queens and the empty squares they share, which also counts "defective regions"
+    correctly. The cache is keyed by the group's bitboards moved to the board's corner, so it holds
+    for the same shape anywhere on the board, and is shared by every game in the process.
+    """
+    # groups with more empty squares than this are counted by area instead of solved
+    limit = 14
+    # positions searched per margin or best_move before giving up on an exact answer (about 0.1s)
+    node_limit = 2000
+    # entries the cache stops growing at
+    cache_limit = 1 << 20
+    # saved caches of another version are not loaded; 2: groups join queens that touch
+    version = 2
+
+    class TooLarge(Exception):
+        pass
+
+    _cache = {}
+    _solvers = {}
+
+    def __init__(self, size):
+        self.size = size
+        self.rays = ejw45_Rays.for_size(size)
+        self.nodes = 0
+        self.budget = self.node_limit
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._solvers:
+            cls._solvers[size] = cls(size)
+        return cls._solvers[size]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as handle:
+            saved = pickle.load(handle)
+        # version 1 saved the bare cache
+        if isinstance(saved, tuple) and saved[0] == cls.version:
+            cls._cache.update(saved[1])
+
+    @classmethod
+    def save(cls, path):
+        with open(path + '.tmp', 'wb') as handle:
+            pickle.dump((cls.version, cls._cache), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def groups(self, queens, empty):
+        """
+        :return: a list of (queens, empty squares) for each group of queens joined through empty squares
+                 or through each other, since a queen that moves off frees her square for the queens next to her
+        """
+        groups = []
+        while queens:
+            seed = queens & -queens
+            joined = seed | self.rays.flood(seed, empty | queens)
+            group = joined & queens
+            region = joined & empty
+
+            queens ^= group
+            if region:
+                groups.append((group, region))
+        return groups
+
+    def moves(self, queens, empty):
+        """
+        :return: (the most moves the queens can make in empty, True if that was solved exactly
+                 rather than counted by area)
+        """
+        total = 0
+        exact = True
+        for group, region in self.groups(queens, empty):
+            area = ejw45_popcount(region)
+            if area > self.limit:
+                total += area
+                exact = False
+            else:
+                total += self.solve(group, region)
+        return total, exact
+
+    def solve(self, queens, empty):
+        size = self.size
+        squares = queens | empty
+        row = ((squares & -squares).bit_length() - 1) // size
+        column = min(square % size for square in ejw45_squares(squares))
+        shift = row * size + column
+
+        key = (size, queens >> shift, empty >> shift)
+        value = self._cache.get(key)
+        if value is None:
+            value = self.search(queens, empty)
+            if len(self._cache) < self.cache_limit:
+                self._cache[key] = value
+        return value
+
+    def search(self, queens, empty):
+        # every move fills one more square, so no group can make more moves than it has empty squares
+        bound = ejw45_popcount(empty)
+        self.nodes += 1
+        if self.nodes > self.budget:
+            raise self.TooLarge()
+
+        full = self.rays.full
+        reach = self.rays.reach
+
+        best = 0
+        for source in ejw45_squares(queens):
+            vacated = empty | (1 << source)
+            for destination in ejw45_squares(reach(source, full & ~empty)):
+                landed = vacated & ~(1 << destination)
+                moved = queens ^ (1 << source) ^ (1 << destination)
+                for arrow in ejw45_squares(reach(destination, full & ~landed)):
+                    value = 1 + self.moves(moved, landed & ~(1 << arrow))[0]
+                    if value > best:
+                        best = value
+                        if best == bound:
+                            return best
+        return best
+
+    def margin(self, state, node_limit=None):
+        """
+        :return: white's moves less black's in a separated position, exact while every group is within
+                 limit and solved within node_limit (or the class's), and otherwise white's area less black's
+        """
+        empty = self.rays.full & ~state.occupied()
+        self.nodes = 0
+        self.budget = node_limit if node_limit is not None else self.node_limit
+        try:
+            return self.moves(state.white, empty)[0] - self.moves(state.black, empty)[0]
+        except self.TooLarge:
+            white_region, black_region = state.regions()
+            return ejw45_popcount(white_region) - ejw45_popcount(black_region)
+
+    def best_move(self, state):
+        """
+        :return: a move making the most of the side to move's regions, or None when the queens are not
+                 walled off yet, a group is too large to solve or there is no move
+        """
+        if not state.separated():
+            return None
+
+        empty = self.rays.full & ~state.occupied()
+        queens = state.queens(state.white_to_move)
+        self.nodes = 0
+        self.budget = self.node_limit
+        try:
+            total, exact = self.moves(queens, empty)
+            if not exact or not total:
+                return None
+
+            best = None
+            best_value = -1
+            for move in state.iter_moves():
+                source, destination, arrow = move
+                moved = queens ^ (1 << source) ^ (1 << destination)
+                value = self.moves(moved, (empty | (1 << source)) & ~(1 << destination) & ~(1 << arrow))[0]
+                if value > best_value:
+                    best = move
+                    best_value = value
+                    if best_value == total - 1:
+                        break
+            return best
+        except self.TooLarge:
+            return None
+
+
+class ejw45_BatchPlayout:
+    """
+    Random playouts for many games at once. The games are stacked as rows of an int8 array
+    (0 empty, 1 white queen, 2 black queen, 3 arrow) with one extra, always blocked column that
+    stands in for every off-board square, so whole rays can be gathered with fancy indexing.
+
+    Each ply picks one of the side's legal queen moves uniformly, then one of the moved
+    queen's arrow squares uniformly, so children are never enumerated.
+    """
+    empty, white, black, arrow = 0, 1, 2, 3
+    # plies between checks for walled-off queens; a separated game stays separated, so checking
+    # less often only delays adjudication a little
+    separation_interval = 4
+
+    _cache = {}
+
+    def __init__(self, size):
+        squares = size * size
+        self.size = size
+        self.squares = squares
+
+        # steps[square, d, k] is the square k + 1 steps from square in direction d, or the blocked
+        # column once the ray leaves the board. Every ray ends in at least one blocked step, and
+        # the blocked column's own rays are blocked straight away.
+        self.steps = np.full((squares + 1, 8, size), squares, dtype=np.intp)
+        rays = ejw45_Rays.for_size(size)
+        for square in range(squares):
+            for d in range(8):
+                line = rays.line(square, d)
+                self.steps[square, d, :len(line)] = line
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._cache:
+            cls._cache[size] = cls(size)
+        return cls._cache[size]
+
+    def reach(self, boards, rows, sources):
+        """
+        :param rows: the games to look at
+        :param sources: (len(rows), queens) array of squares
+        :return: (len(rows), queens, 8) array of how many empty squares each ray from each source passes
+        """
+        rays = self.steps[sources]
+        blocked = boards[rows[:, None, None, None], rays] != self.empty
+        return blocked.argmax(axis=3)
+
+    @staticmethod
+    def pick(lengths, rng):
+        """
+        Choose one reachable square per row uniformly, given the ray lengths of each row.
+        Every row must have at least one reachable square.
+        :return: (index of the chosen ray, number of steps along it less one)
+        """
+        rows = np.arange(len(lengths))
+        cumulative = lengths.cumsum(axis=1)
+        target = (rng.random(len(lengths)) * cumulative[:, -1]).astype(np.intp)
+
+        ray = (cumulative > target[:, None]).argmax(axis=1)
+        return ray, target - (cumulative[rows, ray] - lengths[rows, ray])
+
+    @staticmethod
+    def dilate(grids):
+        """Grow a (games, size, size) bool array by one king step in every direction."""
+        grown = grids.copy()
+        grown[:, 1:] |= grids[:, :-1]
+        grown[:, :-1] |= grids[:, 1:]
+        spread = grown.copy()
+        spread[:, :, 1:] |= grown[:, :, :-1]
+        spread[:, :, :-1] |= grown[:, :, 1:]
+        return spread
+
+    def grids(self, boards, rows, symbol):
+        return (boards[rows, :self.squares] == symbol).reshape(len(rows), self.size, self.size)
+
+    def regions(self, boards, rows):
+        """The batched ejw45_BitBoard.regions: (white regions, black regions) as (len(rows), size, size) arrays."""
+        empty = self.grids(boards, rows, self.empty)
+        empty = np.concatenate([empty, empty])
+        seeds = np.concatenate([self.grids(boards, rows, self.white), self.grids(boards, rows, self.black)])
+
+        region = np.zeros_like(seeds)
+        frontier = self.dilate(seeds) & empty
+        while frontier.any():
+            region |= frontier
+            frontier = self.dilate(frontier) & empty & ~region
+
+        return region[:len(rows)], region[len(rows):]
+
+    def separated(self, boards, rows):
+        """The batched ejw45_BitBoard.separated, flooding only the games that are still undecided."""
+        empty = self.grids(boards, rows, self.empty)
+        black_border = self.dilate(self.grids(boards, rows, self.black)) & empty
+
+        separated = np.ones(len(rows), dtype=bool)
+        open_games = np.arange(len(rows))
+        region = np.zeros_like(empty)
+        frontier = self.dilate(self.grids(boards, rows, self.white)) & empty
+
+        while open_games.size:
+            touching = (frontier & black_border[open_games]).any(axis=(1, 2))
+            separated[open_games[touching]] = False
+
+            growing = ~touching & frontier.any(axis=(1, 2))
+            open_games = open_games[growing]
+            region = region[growing] | frontier[growing]
+            frontier = self.dilate(frontier[growing]) & empty[open_games] & ~region
+
+        return separated
+
+    def run(self, state, games, rng=None, adjudicate=True, cap=None):
+        """
+        Play games random games from state.
+        :param adjudicate: stop a game as soon as the queens are walled off and score it by territory
+        :param cap: stop every game after this many plies and score it with ejw45_Evaluator
+        :return: a bool array with True where white won
+        """
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+
+        squares = self.squares
+        white = list(ejw45_squares(state.white))
+        black = list(ejw45_squares(state.black))
+        queen_count = max(len(white), len(black))
+
+        boards = np.zeros((games, squares + 1), dtype=np.int8)
+        boards[:, squares] = self.arrow
+        boards[:, white] = self.white
+        boards[:, black] = self.black
+        boards[:, list(ejw45_squares(state.arrows))] = self.arrow
+
+        # queens[game, side] holds side's queen squares (0 white, 1 black), padded with the blocked column
+        queens = np.full((games, 2, queen_count), squares, dtype=np.intp)
+        queens[:, 0, :len(white)] = white
+        queens[:, 1, :len(black)] = black
+
+        to_move = np.full(games, 0 if state.white_to_move else 1, dtype=np.intp)
+        white_won = np.zeros(games, dtype=bool)
+        rows = np.arange(games)
+        plies = 0
+
+        while rows.size:
+            if cap is not None and plies >= cap:
+                margin = ejw45_Evaluator.for_size(self.size).evaluate_batch(boards[rows, :squares], to_move[rows] == 0)
+                white_won[rows] = (margin > 0) | ((margin == 0) & (to_move[rows] == 1))
+                break
+
+            if adjudicate and plies % self.separation_interval == 0:
+                separated = self.separated(boards, rows)
+
+                if separated.any():
+                    finished = rows[separated]
+                    white_region, black_region = self.regions(boards, finished)
+                    margin = white_region.sum(axis=(1, 2)) - black_region.sum(axis=(1, 2))
+                    white_won[finished] = (margin > 0) | ((margin == 0) & (to_move[finished] == 1))
+                    rows = rows[~separated]
+                    if not rows.size:
+                        break
+
+            side = to_move[rows]
+            sources = queens[rows, side]
+            lengths = self.reach(boards, rows, sources).reshape(len(rows), -1)
+
+            # the side to move loses once none of its queens can move
+            stuck = lengths.sum(axis=1) == 0
+            if stuck.any():
+                white_won[rows[stuck]] = side[stuck] == 1
+                moving = ~stuck
+                rows, side, sources, lengths = rows[moving], side[moving], sources[moving], lengths[moving]
+                if not rows.size:
+                    break
+
+            ray, k = self.pick(lengths, rng)
+            queen, direction = np.divmod(ray, 8)
+            source = sources[np.arange(len(rows)), queen]
+            destination = self.steps[source, direction, k]
+
+            boards[rows, source] = self.empty
+            boards[rows, destination] = side + 1
+            queens[rows, side, queen] = destination
+
+            # a queen that just moved can always shoot back over the square she left
+            lengths = self.reach(boards, rows, destination[:, None]).reshape(len(rows), -1)
+            direction, k = self.pick(lengths, rng)
+            boards[rows, self.steps[destination, direction, k]] = self.arrow
+
+            to_move[rows] ^= 1
+            plies += 1
+
+        return white_won
+
+
+class ejw45_Evaluator:
+    """
+    The queen-distance / king-distance territory heuristic. For each side and each empty square it
+    finds the fewest queen moves and the fewest king steps any of the side's queens needs to get
+    there, then counts the squares each side reaches first. Squares both reach at the same distance
+    count tempo in favour of the side to move. The value is from white's point of view: the
+    queen-distance margin plus king_weight times the king-distance margin.
+
+    evaluate runs the searches over bitboards for one position; evaluate_batch runs them over
+    NumPy arrays for many positions at once.
+    """
+    king_weight = 0.25
+    tempo = 0.2
+
+    _cache = {}
+
+    def __init__(self, size):
+        self.size = size
+        self.rays = ejw45_Rays.for_size(size)
+        # distance given to squares a side cannot reach at all
+        self.unreachable = size * size
+
+    @classmethod
+    def for_size(cls, size):
+        if size not in cls._cache:
+            cls._cache[size] = cls(size)
+        return cls._cache[size]
+
+    def queen_layers(self, queens, occupied):
+        """:return: a list of bitboards; layer d holds the empty squares first reached in d + 1 queen moves"""
+        reach = self.rays.reach
+        layers = []
+        reached = 0
+        frontier = queens
+
+        while frontier:
+            step = 0
+            for square in ejw45_squares(frontier):
+                step |= reach(square, occupied)
+            frontier = step & ~reached
+            reached |= frontier
+            if frontier:
+                layers.append(frontier)
+
+        return layers
+
+    def king_layers(self, queens, empty):
+        """:return: a list of bitboards; layer d holds the empty squares first reached in d + 1 king steps"""
+        dilate = self.rays.dilate
+        layers = []
+        reached = 0
+        frontier = queens
+
+        while True:
+            frontier = dilate(frontier) & empty & ~reached
+            if not frontier:
+                return layers
+            reached |= frontier
+            layers.append(frontier)
+
+    def distances(self, layers):
+        distance = np.full((1, self.size * self.size), self.unreachable, dtype=np.int16)
+        for d, layer in enumerate(layers):
+            distance[0, list(ejw45_squares(layer))] = d + 1
+        return distance
+
+    def evaluate(self, state, white_to_move=None):
+        """
+        :param state: an ejw45_BitBoard, or an ejw45_Board together with the side to move
+        :return: the value of the position for white
+        """
+        if isinstance(state, ejw45_Board):
+            state = ejw45_BitBoard.from_config(state.board, white_to_move)
+
+        occupied = state.occupied()
+        empty = self.rays.full & ~occupied
+
+        return float(self.score(self.distances(self.queen_layers(state.white, occupied)),
+                                self.distances(self.queen_layers(state.black, occupied)),
+                                self.distances(self.king_layers(state.white, empty)),
+                                self.distances(self.king_layers(state.black, empty)),
+                                np.array([state.white_to_move]))[0])
+
+    @staticmethod
+    def shift(grids, dr, dc):
+        """Move every cell of a (positions, size, size) bool array dr rows and dc columns, dropping what falls off."""
+        size = grids.shape[1]
+        shifted = np.zeros_like(grids)
+        rows_to, rows_from = (slice(dr, size), slice(0, size - dr)) if dr >= 0 else (slice(0, size + dr), slice(-dr, size))
+        cols_to, cols_from = (slice(dc, size), slice(0, size - dc)) if dc >= 0 else (slice(0, size + dc), slice(-dc, size))
+        shifted[:, rows_to, cols_to] = grids[:, rows_from, cols_from]
+        return shifted
+
+    def slide(self, frontier, empty):
+        """:return: the empty squares one queen move away from frontier, for every position"""
+        reached = np.zeros_like(frontier)
+        for dr, dc in ejw45_Rays.directions:
+            ray = self.shift(frontier, dr, dc) & empty
+            moving = ray
+            while moving.any():
+                moving = self.shift(moving, dr, dc) & empty & ~ray
+                ray |= moving
+            reached |= ray
+        return reached
+
+    def batch_distances(self, seeds, empty, step):
+        distance = np.full(seeds.shape, self.unreachable, dtype=np.int16)
+        reached = np.zeros_like(seeds)
+        frontier = seeds
+        d = 1
+
+        while True:
+            frontier = step(frontier) & empty & ~reached
+            if not frontier.any():
+                return distance.reshape(len(seeds), -1)
+            distance[frontier] = d
+            reached |= frontier
+            d += 1
+
+    def evaluate_batch(self, boards, white_to_move):
+        """
+        :param boards: a (positions, size * size) int array coded as in ejw45_BatchPlayout
+        :param white_to_move: a (positions,) bool array
+        :return: a (positions,) array of values for white
+        """
+        grids = np.asarray(boards).reshape(-1, self.size, self.size)
+        empty = grids == ejw45_BatchPlayout.empty
+        white = grids == ejw45_BatchPlayout.white
+        black = grids == ejw45_BatchPlayout.black
+
+        slide = lambda frontier: self.slide(frontier, empty)
+        dilate = ejw45_BatchPlayout.dilate
+
+        return self.score(self.batch_distances(white, empty, slide),
+                          self.batch_distances(black, empty, slide),
+                          self.batch_distances(white, empty, dilate),
+                          self.batch_distances(black, empty, dilate),
+                          np.asarray(white_to_move))
+
+    def compare(self, white, black, tempo):
+        closer = np.sign(black - white)
+        tied = (white == black) & (white < self.unreachable)
+        return (closer + tied * tempo[:, None]).sum(axis=1)
+
+    def score(self, queen_white, queen_black, king_white, king_black, white_to_move):
+        tempo = np.where(white_to_move, self.tempo, -self.tempo)
+        return (self.compare(queen_white, queen_black, tempo) +
+                self.king_weight * self.compare(king_white, king_black, tempo))
+
+    @staticmethod
+    def stack(states):
+        """:return: (boards, white_to_move) arrays for evaluate_batch from a list of ejw45_BitBoards"""
+        boards = np.zeros((len(states), states[0].size ** 2), dtype=np.int8)
+        for row, state in enumerate(states):
+            for bitboard, symbol in ((state.white, ejw45_BatchPlayout.white), (state.black, ejw45_BatchPlayout.black),
+                                     (state.arrows, ejw45_BatchPlayout.arrow)):
+                boards[row, list(ejw45_squares(bitboard))] = symbol
+        return boards, np.array([state.white_to_move for state in states])
+
+
+class ejw45_KnowledgeBase:
+    """
+    A read-only table of position key -> (wins, plays) on disk: a small versioned header followed
+    by fixed-size records sorted by key. The records are memory-mapped, so opening a table costs
+    the same however large it is, lookups read straight from the mapped pages, and processes
+    opening the same file share those pages.
+    """
+    magic = b'EJW45KB\x00'
+    # 2: keys are canonical keys (ejw45_BitBoard.canonical_key); 1 held plain Zobrist keys
+    version = 2
+    # magic, version, reserved, record count
+    header = struct.Struct('<8sIIQ')
+    record = np.dtype([('key', '<u8'), ('wins', '<u4'), ('plays', '<u4')])
+
+    def __init__(self, path=None):
+        """:param path: a file written by write, or None for an empty table"""
+        self.path = path
+        self.records = np.zeros(0, dtype=self.record)
+
+        if path is not None:
+            with open(path, 'rb') as handle:
+                magic, version, _, count = self.header.unpack(handle.read(self.header.size))
+
+            if magic != self.magic:
+                raise ValueError('{} is not an ejw45 knowledge base'.format(path))
+            if version != self.version:
+                raise ValueError('{} has version {}, expected {}'.format(path, version, self.version))
+
+            if count:
+                self.records = np.memmap(path, dtype=self.record, mode='r', offset=self.header.size, shape=(count,))
+
+        self.keys = self.records['key']
+
+    @classmethod
+    def file_version(cls, path):
+        with open(path, 'rb') as handle:
+            return cls.header.unpack(handle.read(cls.header.size))[1]
+
+    def find(self, key):
+        """:return: the index of key's record, or -1"""
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return -1
+
+    def get(self, key, default=None):
+        index = self.find(key)
+        if index < 0:
+            return default
+        record = self.records[index]
+        return int(record['wins']), int(record['plays'])
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return len(self.records)
+
+    def items(self):
+        for key, wins, plays in self.records:
+            yield int(key), (int(wins), int(plays))
+
+    @classmethod
+    def merge(cls, base, updates):
+        """:return: base's records with every key -> (wins, plays) in updates replacing or adding to them, sorted"""
+        added = np.zeros(len(updates), dtype=cls.record)
+        if updates:
+            added['key'] = np.fromiter(updates.keys(), dtype=np.uint64, count=len(updates))
+            counts = np.array(list(updates.values()), dtype=np.uint32).reshape(-1, 2)
+            added['wins'] = counts[:, 0]
+            added['plays'] = counts[:, 1]
+
+        kept = base.records[~np.isin(base.keys, added['key'])]
+        records = np.concatenate([np.asarray(kept), added])
+        return records[np.argsort(records['key'], kind='stable')]
+
+    @classmethod
+    def write(cls, path, records):
+        """Write sorted records to path. The file is replaced atomically, so readers never see half a table."""
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(cls.header.pack(cls.magic, cls.version, 0, len(records)))
+            handle.write(np.ascontiguousarray(records, dtype=cls.record).tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def from_pickle(cls, pickle_path, path):
+        """
+        One-time conversion of a pickled explored dict keyed by ejw45_Board into path. Symmetric
+        positions are pooled. Plain Zobrist keys cannot be made canonical and are left out.
+        """
+        with open(pickle_path, 'rb') as handle:
+            explored = pickle.load(handle)
+
+        updates = dict()
+        skipped = 0
+        for state, (wins, plays) in explored.items():
+            if not isinstance(state, ejw45_Board):
+                skipped += 1
+                continue
+            key = ejw45_BitBoard.from_config(state.board).canonical_key()
+            total_wins, total_plays = updates.get(key, (0, 0))
+            updates[key] = (total_wins + wins, total_plays + plays)
+
+        if skipped:
+            print('left out', skipped, 'entries keyed by plain Zobrist keys')
+
+        cls.write(path, cls.merge(cls(), updates))
+        return cls(path)
+
+
+class ejw45_Table:
+    """
+    The explored table: (wins, plays) per position key. New counts are kept in a dict layered over
+    an ejw45_KnowledgeBase.
+
+    A table opened on a path checkpoints incrementally: checkpoint appends only the counts changed
+    since the last checkpoint to path + '.log', and once the log outgrows the knowledge base it is
+    compacted into a new knowledge base file. Log records hold absolute counts, so replaying a log
+    over the knowledge base it was written against, even after a crash mid-compaction, is safe.
+    """
+    # compact once the log holds more records than compact_factor times the knowledge base
+    # (and at least compact_minimum), so compaction stays proportional to the work logged
+    compact_factor = 1.0
+    compact_minimum = 65536
+
+    def __init__(self, base=None, path=None):
+        self.base = base if base is not None else ejw45_KnowledgeBase()
+        self.updates = dict()
+        # keys in updates that are not in base
+        self.added = 0
+
+        self.path = path
+        # keys changed since the last checkpoint, and the number of records in the log
+        self.dirty = set()
+        self.logged = 0
+
+    @classmethod
+    def open(cls, path):
+        """Open the knowledge base at path, if there is one, and replay its log."""
+        table = cls(ejw45_KnowledgeBase(path) if os.path.isfile(path) else None, path)
+        table.replay()
+        return table
+
+    def log_path(self):
+        return self.path + '.log'
+
+    def replay(self):
+        if not os.path.isfile(self.log_path()):
+            return
+
+        with open(self.log_path(), 'rb') as handle:
+            data = handle.read()
+
+        # a crash while appending can leave a torn record at the end
+        size = ejw45_KnowledgeBase.record.itemsize
+        complete = len(data) - len(data) % size
+        if complete != len(data):
+            with open(self.log_path(), 'r+b') as handle:
+                handle.truncate(complete)
+
+        records = np.frombuffer(data[:complete], dtype=ejw45_KnowledgeBase.record)
+        for key, wins, plays in records:
+            self[int(key)] = (int(wins), int(plays))
+
+        self.dirty = set()
+        self.logged = len(records)
+
+    def get(self, key, default=None):
+        value = self.updates.get(key)
+        if value is None:
+            return self.base.get(key, default)
+        return value
+
+    def __contains__(self, key):
+        return key in self.updates or key in self.base
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.updates and key not in self.base:
+            self.added += 1
+        self.updates[key] = value
+        self.dirty.add(key)
+
+    def __len__(self):
+        return len(self.base) + self.added
+
+    def items(self):
+        for key, value in self.base.items():
+            if key not in self.updates:
+                yield key, value
+        for item in self.updates.items():
+            yield item
+
+    def flush(self):
+        """Append the counts changed since the last flush to the log and sync it to disk."""
+        if not self.dirty:
+            return
+
+        records = np.zeros(len(self.dirty), dtype=ejw45_KnowledgeBase.record)
+        records['key'] = np.fromiter(self.dirty, dtype=np.uint64, count=len(self.dirty))
+        counts = np.array([self.updates[key] for key in self.dirty], dtype=np.uint32)
+        records['wins'] = counts[:, 0]
+        records['plays'] = counts[:, 1]
+
+        with open(self.log_path(), 'ab') as handle:
+            handle.write(records.tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        self.logged += len(records)
+        self.dirty = set()
+
+    def checkpoint(self):
+        """Flush the changed counts to the log, compacting it into the knowledge base once it is large."""
+        if self.path is None:
+            return
+
+        self.flush()
+        if self.logged > max(self.compact_minimum, self.compact_factor * len(self.base)):
+            self.save(self.path)
+
+    def save(self, path):
+        """Merge the updates into a new knowledge base at path, map it as the base and start an empty log."""
+        if path == self.path:
+            # the log then agrees with the new knowledge base if we crash before it is emptied
+            self.flush()
+
+        ejw45_KnowledgeBase.write(path, ejw45_KnowledgeBase.merge(self.base, self.updates))
+        self.base = ejw45_KnowledgeBase(path)
+        self.updates = dict()
+        self.added = 0
+
+        self.path = path
+        temporary = self.log_path() + '.tmp'
+        open(temporary, 'wb').close()
+        os.replace(temporary, self.log_path())
+        self.dirty = set()
+        self.logged = 0
+
+
+class ejw45_TranspositionTable:
+    """
+    A fixed-capacity explored table for long training runs. Entries live in NumPy arrays sized from
+    a memory budget and grouped into buckets of bucket_size slots picked by key. When a new key
+    finds its bucket full it replaces the entry last updated in the oldest generation, least
+    visited first. checkpoint starts a new generation.
+
+    With a path, the knowledge base there and its log are kept open as an ejw45_Table. Each slot
+    also keeps the counts it was loaded or last committed with, so only what the table has counted
+    since is added to it: for every changed slot every save_interval checkpoints, and for a slot
+    about to be evicted. The ejw45_Table appends those to its log and compacts it as usual.
+
+    It counts lookups, hits, stores and evictions; see statistics.
+    """
+    bucket_size = 4
+    # bytes per slot: key, wins, plays, generation, and the saved wins and plays
+    slot_bytes = 8 + 4 + 4 + 2 + 4 + 4
+    # checkpoints between committing the changed slots to the log
+    save_interval = 100
+    # knowledge base records scanned at a time by open
+    load_chunk = 1 << 20
+
+    def __init__(self, budget, path=None):
+        """
+        :param budget: bytes the table may use
+        :param path: ejw45_KnowledgeBase file the table is saved to, or None
+        """
+        self.buckets = max(1, budget // (self.slot_bytes * self.bucket_size))
+        capacity = self.buckets * self.bucket_size
+
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.wins = np.zeros(capacity, dtype=np.uint32)
+        # 0 marks an empty slot, since every stored entry has been played
+        self.plays = np.zeros(capacity, dtype=np.uint32)
+        self.generations = np.zeros(capacity, dtype=np.uint16)
+        self.generation = 0
+        self.saved_wins = np.zeros(capacity, dtype=np.uint32)
+        self.saved_plays = np.zeros(capacity, dtype=np.uint32)
+
+        self.path = path
+        # the ejw45_Table at path that counts are committed to, once opened
+        self.stored = None
+        self.occupied = 0
+        self.lookups = self.hits = self.stores = self.evictions = 0
+
+    @classmethod
+    def open(cls, path, budget):
+        """
+        Open the knowledge base at path and its log (see ejw45_Table), loading the most visited
+        entries that fit. The knowledge base is scanned load_chunk records at a time.
+        """
+        table = cls(budget, path)
+        stored = table.stored = ejw45_Table.open(path)
+        capacity = len(table.keys)
+
+        def most_visited(records):
+            if len(records) <= capacity:
+                return records
+            return records[np.argpartition(records['plays'], len(records) - capacity)[len(records) - capacity:]]
+
+        # the log's counts replace those in the knowledge base
+        best = np.zeros(len(stored.updates), dtype=ejw45_KnowledgeBase.record)
+        if stored.updates:
+            best['key'] = np.fromiter(stored.updates.keys(), dtype=np.uint64, count=len(stored.updates))
+            counts = np.array(list(stored.updates.values()), dtype=np.uint32).reshape(-1, 2)
+            best['wins'] = counts[:, 0]
+            best['plays'] = counts[:, 1]
+        logged = best['key'].copy()
+        best = most_visited(best)
+
+        records = stored.base.records
+        for start in range(0, len(records), cls.load_chunk):
+            chunk = np.asarray(records[start:start + cls.load_chunk])
+            best = most_visited(np.concatenate([best, chunk[~np.isin(chunk['key'], logged)]]))
+
+        # least visited first, so the most visited are stored last and win their buckets
+        for key, wins, plays in best[np.argsort(best['plays'], kind='stable')].tolist():
+            slot = table.store(key, (wins, plays))
+            table.saved_wins[slot], table.saved_plays[slot] = wins, plays
+        table.lookups = table.stores = table.evictions = 0
+        return table
+
+    def bucket(self, key):
+        start = (key % self.buckets) * self.bucket_size
+        return start, self.keys[start:start + self.bucket_size].tolist()
+
+    def find(self, key):
+        """:return: the slot holding key, or -1"""
+        self.lookups += 1
+        start, keys = self.bucket(key)
+        for offset, slot_key in enumerate(keys):
+            if slot_key == key and self.plays[start + offset]:
+                self.hits += 1
+                return start + offset
+        return -1
+
+    def get(self, key, default=None):
+        slot = self.find(key)
+        if slot < 0:
+            return default
+        return int(self.wins[slot]), int(self.plays[slot])
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store(key, value)
+
+    def store(self, key, value):
+        """:return: the slot value is stored in for key"""
+        start, keys = self.bucket(key)
+        end = start + self.bucket_size
+        plays = self.plays[start:end].tolist()
+
+        slot = None
+        for offset, slot_key in enumerate(keys):
+            if slot_key == key and plays[offset]:
+                slot = start + offset
+                break
+
+        if slot is None:
+            if 0 in plays:
+                slot = start + plays.index(0)
+                self.occupied += 1
+            else:
+                # replace the stalest entry, then the least visited
+                ages = [(self.generation - generation) & 0xFFFF for generation in self.generations[start:end].tolist()]
+                slot = start + min(range(self.bucket_size), key=lambda offset: (-ages[offset], plays[offset]))
+                self.evictions += 1
+                if self.stored is not None:
+                    self.commit(np.array([slot]))
+            self.keys[slot] = key
+            self.saved_wins[slot] = self.saved_plays[slot] = 0
+
+        self.wins[slot], self.plays[slot] = value
+        self.generations[slot] = self.generation
+        self.stores += 1
+        return slot
+
+    def __len__(self):
+        return self.occupied
+
+    def items(self):
+        for slot in np.flatnonzero(self.plays):
+            yield int(self.keys[slot]), (int(self.wins[slot]), int(self.plays[slot]))
+
+    def statistics(self):
+        capacity = len(self.keys)
+        return {
+            'capacity': capacity,
+            'bytes': capacity * self.slot_bytes,
+            'occupancy': self.occupied / float(capacity),
+            'lookups': self.lookups,
+            'hit_rate': self.hits / float(self.lookups) if self.lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
+
+    def commit(self, slots):
+        """Add what slots have counted since they were last committed to the stored table."""
+        for key, wins, plays, saved_wins, saved_plays in zip(
+                self.keys[slots].tolist(), self.wins[slots].tolist(), self.plays[slots].tolist(),
+                self.saved_wins[slots].tolist(), self.saved_plays[slots].tolist()):
+            total_wins, total_plays = self.stored.get(key, (0, 0))
+            self.stored[key] = (total_wins + wins - saved_wins, total_plays + plays - saved_plays)
+        self.saved_wins[slots] = self.wins[slots]
+        self.saved_plays[slots] = self.plays[slots]
+
+    def checkpoint(self):
+        """Start a new generation; every save_interval, commit the changed slots and flush them to the log."""
+        self.generation = (self.generation + 1) & 0xFFFF
+        if self.stored is not None and self.generation % self.save_interval == 0:
+            self.commit(np.flatnonzero(self.plays != self.saved_plays))
+            self.stored.checkpoint()
+
+    def save(self, path):
+        """Commit the changed slots to the knowledge base at path and compact it."""
+        if self.stored is None or self.stored.path != path:
+            self.stored = ejw45_Table.open(path)
+            self.path = path
+        self.commit(np.flatnonzero(self.plays != self.saved_plays))
+        self.stored.save(path)
+
+
+class ejw45_Rave:
+    """
+    All-moves-as-first statistics for one board size: for each side, how often it won the playouts
+    in which it played a given queen move (queen_start, queen_end), and those in which it shot an
+    arrow to a given square, at any point after the root. Kept in flat arrays indexed by
+    (colour, queen_start, queen_end) and (colour, arrow).
+    """
+
+    def __init__(self, size):
+        squares = size * size
+        self.size = size
+        self.squares = squares
+        self.queen_wins = np.zeros(2 * squares * squares)
+        self.queen_plays = np.zeros(2 * squares * squares)
+        self.arrow_wins = np.zeros(2 * squares)
+        self.arrow_plays = np.zeros(2 * squares)
+
+    def queen_index(self, white, source, destination):
+        return (white * self.squares + source) * self.squares + destination
+
+    def update(self, moves, white_first, white_wins, playouts=1):
+        """
+        Credit playouts games, white_wins of them won by white, to every move played in them.
+        :param moves: the whole moves played from the root, in order, starting with white if white_first
+        """
+        queens = {}
+        arrows = {}
+        white = white_first
+        for source, destination, arrow in moves:
+            won = white_wins if white else playouts - white_wins
+            # only the first time a side plays a move counts
+            queens.setdefault(self.queen_index(white, source, destination), won)
+            arrows.setdefault(white * self.squares + arrow, won)
+            white = not white
+
+        for wins, plays, played in ((self.queen_wins, self.queen_plays, queens),
+                                    (self.arrow_wins, self.arrow_plays, arrows)):
+            index = np.fromiter(played.keys(), dtype=np.intp, count=len(played))
+            wins[index] += np.fromiter(played.values(), dtype=np.float64, count=len(played))
+            plays[index] += playouts
+
+    def get(self, node):
+        """:return: (wins, plays) for the side that played node's move: its queen move for a queen node,
+                    its arrow below a queen node, and both together for a whole move node of a flat tree"""
+        move = node.move
+        white = node.white
+        if len(move) == 2:
+            index = self.queen_index(white, move[0], move[1])
+            return self.queen_wins[index], self.queen_plays[index]
+
+        arrow = white * self.squares + move[2]
+        if node.parent is not None and node.parent.key is None:
+            return self.arrow_wins[arrow], self.arrow_plays[arrow]
+
+        index = self.queen_index(white, move[0], move[1])
+        return (self.queen_wins[index] + self.arrow_wins[arrow],
+                self.queen_plays[index] + self.arrow_plays[arrow])
+
+
+class ejw45_Book:
+    """
+    Opening moves searched ahead of time by book.py. For each position, keyed by board size and
+    canonical key, it holds the searched moves with their (wins, visits), in the orientation of the
+    canonical key's symmetry. On disk it is a versioned header followed by one record per move,
+    like ejw45_KnowledgeBase; it is small enough to be read into a dict, so a lookup costs one key.
+    The move played is the most visited one.
+    """
+    magic = b'EJW45BK\x00'
+    version = 1
+    # magic, version, reserved, record count
+    header = struct.Struct('<8sIIQ')
+    record = np.dtype([('key', '<u8'), ('size', 'u1'), ('source', 'u1'), ('destination', 'u1'), ('arrow', 'u1'),
+                       ('wins', '<u4'), ('visits', '<u4')])
+
+    def __init__(self, path=None):
+        """:param path: a file written by write, or None for an empty book"""
+        self.path = path
+        # (size, canonical key) -> {move: (wins, visits)}
+        self.positions = {}
+
+        if path is not None:
+            with open(path, 'rb') as handle:
+                magic, version, _, count = self.header.unpack(handle.read(self.header.size))
+                if magic != self.magic:
+                    raise ValueError('{} is not an ejw45 opening book'.format(path))
+                if version != self.version:
+                    raise ValueError('{} has version {}, expected {}'.format(path, version, self.version))
+                records = np.frombuffer(handle.read(count * self.record.itemsize), dtype=self.record)
+
+            for key, size, source, destination, arrow, wins, visits in records.tolist():
+                self.positions.setdefault((size, key), {})[(source, destination, arrow)] = (wins, visits)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, position):
+        return position in self.positions
+
+    def add(self, size, key, statistics):
+        """Add statistics, a dict of move -> (wins, visits) searched from the position, to what the book holds."""
+        moves = self.positions.setdefault((size, key), {})
+        for move, (wins, visits) in statistics.items():
+            total_wins, total_visits = moves.get(move, (0, 0))
+            moves[move] = (total_wins + wins, total_visits + visits)
+
+    def merge(self, other):
+        for (size, key), statistics in other.positions.items():
+            self.add(size, key, statistics)
+
+    def lookup(self, state):
+        """:return: the book's move for state, in square numbers as state stands, or None if it has none"""
+        key, t = ejw45_Symmetry.for_size(state.size).canonical(state)
+        statistics = self.positions.get((state.size, key))
+        if not statistics:
+            return None
+
+        move = max(statistics, key=lambda move: statistics[move][1])
+        source, destination, arrow = ejw45_Symmetry.for_size(state.size).restore_move(move, t)
+
+        # a key collision would give a move from some other position
+        if not (state.queens(state.white_to_move) >> source) & 1:
+            return None
+        if not (state.rays.reach(source, state.occupied()) >> destination) & 1:
+            return None
+        if not (state.arrow_moves(source, destination) >> arrow) & 1:
+            return None
+        return source, destination, arrow
+
+    def write(self, path):
+        """Write the book to path, replacing it atomically."""
+        rows = [(key, size) + move + counts
+                for (size, key), statistics in self.positions.items() for move, counts in statistics.items()]
+        records = np.array(sorted(rows), dtype=self.record)
+
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(self.header.pack(self.magic, self.version, 0, len(records)))
+            handle.write(records.tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, path)
+
+
+class ejw45_Node:
+    """
+    A node of the search tree: the position reached by playing move from the parent's position.
+    wins are counted for the side that played move, so a parent picks the child with the best
+    win rate for itself. key identifies the position as it stands on the board, canonical
+    (ejw45_BitBoard.canonical_key) indexes the explored table.
+
+    With ejw45_MonteCarlo.two_stage a move is split over two nodes: a queen node whose move is
+    (queen_start, queen_end) and whose keys are None, as it stands for no position of its own,
+    and below it one node per arrow, whose move is the whole (queen_start, queen_end, arrow).
+    """
+    __slots__ = ('move', 'parent', 'key', 'canonical', 'white', 'children', 'untried', 'wins', 'visits')
+
+    def __init__(self, move, parent, key, white, canonical=None):
+        self.move = move
+        self.parent = parent
+        self.key = key
+        # the key of the position in explored, shared with its symmetric variants
+        self.canonical = canonical
+        # True if white played move
+        self.white = white
+        self.children = []
+        # the legal moves not yet expanded, filled in on the first visit
+        self.untried = None
+        self.wins = 0
+        self.visits = 0
+
+    def expanded(self):
+        return self.untried is not None and not self.untried
+
+    def best_child(self, exploration, rave=None, equivalence=0):
+        """
+        Pick the child with the highest UCB1 score, using the parent's visit count.
+        :param rave: ejw45_Rave whose all-moves-as-first win rate is blended into each child's,
+                     weighted sqrt(equivalence / (3 * visits + equivalence)), or None
+        """
+        log_visits = log(self.visits)
+        max_child = None
+        max_score = None
+
+        for child in self.children:
+            mean = child.wins / child.visits
+            if rave is not None:
+                wins, plays = rave.get(child)
+                if plays:
+                    beta = sqrt(equivalence / (3.0 * child.visits + equivalence))
+                    mean = (1.0 - beta) * mean + beta * wins / plays
+
+            score = mean + exploration * sqrt(log_visits / child.visits)
+            if max_score is None or score > max_score:
+                max_score = score
+                max_child = child
+
+        return max_child
+
+    def find(self, key, depth):
+        """Find the descendant at most depth plies below this node whose position has the given key."""
+        if self.key == key:
+            return self
+        if depth > 0:
+            for child in self.children:
+                # queen nodes are half a ply
+                found = child.find(key, depth if child.key is None else depth - 1)
+                if found is not None:
+                    return found
+        return None
+
+    def size(self):
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
 
 
 class ejw45_MonteCarlo:
-    class Player:
-        def __init__(self, white):
-            self.path = []
-            self.white = white
-            self.other_player = None
-
-        def update(self, state):
-            self.path.append(state)
-
-        def clear(self):
-            self.path = []
-
-        def other(self):
-            return self.other_player
-
-    def __init__(self, training_iterations=0):
-
-        self.start = ejw45_Board(np.array([['.', '.', '.', 'q', '.', '.', 'q', '.', '.', '.'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['q', '.', '.', '.', '.', '.', '.', '.', '.', 'q'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['Q', '.', '.', '.', '.', '.', '.', '.', '.', 'Q'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['.', '.', '.', '.', '.', '.', '.', '.', '.', '.'],
-                                           ['.', '.', '.', 'Q', '.', '.', 'Q', '.', '.', '.']]))
-
-        self.white_player = ejw45_MonteCarlo.Player(True)
-        self.black_player = ejw45_MonteCarlo.Player(False)
-        self.white_player.other_player = self.black_player
-        self.black_player.other_player = self.white_player
-
-        self.explored = dict()
-
-        if os.path.isfile('ejw45_amazon.pickle'):
-            print('reading in from file')
-            with open('ejw45_amazon.pickle', 'rb') as handle:
-                self.explored = pickle.load(handle)
+    exploration = 1.4
+    # seconds to leave on the clock when searching up to a deadline
+    time_margin = 0.5
+    # processes searching in parallel (including this one); None uses every core
+    workers = 1
+    # seconds reserved for collecting and merging the parallel workers' results
+    merge_margin = 0.2
+    # random games played at once from each new leaf; above 1 they run on ejw45_BatchPlayout
+    rollout_batch = 1
+    # stop rollouts once the queens are walled off from each other and score them with ejw45_Endgame,
+    # searching at most endgame_nodes positions for an exact score
+    adjudicate = True
+    endgame_nodes = 200
+    # stop rollouts after this many plies and score them with ejw45_Evaluator; 0 scores every new leaf
+    # straight away and None plays rollouts out. At equal time per move on 10x10 a cap of 20 won
+    # 16 of 20 games at 0.3s and 13 of 20 at 0.1s against rollouts played out (benchmark.py cap)
+    rollout_cap = 20
+    # playouts after which training starts a fresh tree, bounding it to about twice as many nodes;
+    # None keeps one tree
+    tree_limit = 100000
+    # split every move into a queen node and an arrow node (see ejw45_Node)
+    two_stage = True
+    # progressive widening: a node visited n times may have widening * n ** widening_exponent
+    # children, best first by a cheap ordering; None expands every move before descending.
+    # At 0.3s per move on 10x10 the two together won 18 of 20 games against the flat tree
+    # (benchmark.py flat); two_stage alone won 3 of 20, so widening is what pays
+    widening = 1.0
+    widening_exponent = 0.5
+    # blend all-moves-as-first statistics (ejw45_Rave) into selection; equal weight at
+    # rave_equivalence / 3 visits of a child, None turns them off
+    rave_equivalence = 300
+    # answer the positions in the opening book (see ejw45_Book) without searching
+    use_book = True
+    # start a new node with what explored knows of its position, scaled down to at most this many
+    # visits so the search can still overrule it; 0 starts every node empty
+    prior_visits = 10
+
+    def __init__(self, training_iterations=0, path='ejw45_amazon.kb', table_budget=None, start=None):
+        """
+        :param training_iterations: number of playouts to train from the start position
+        :param path: ejw45_KnowledgeBase file the explored table is read from and saved to,
+                     or None to start empty. One that needs ejw45_convert first is left alone.
+        :param table_budget: bytes to cap the explored table at (an ejw45_TranspositionTable),
+                             or None to let it grow
+        :param start: ejw45_BitBoard to train from, or None for the standard 10x10 game
+        """
+        self.path = path
+        self.pool = None
+        self.book = ejw45_Book()
+
+        if start is None:
+            start = ejw45_start_position()
+        self.start = start
+
+        # the search tree is rooted at the position in self.state
+        self.state = None
+        self.root = None
+        self.rave = None
+        self.reroot(self.start)
+
+        if table_budget is not None:
+            self.explored = ejw45_TranspositionTable(table_budget)
+        else:
+            self.explored = ejw45_Table()
+
+        if path is not None and self.needs_conversion(path):
+            print(path, 'needs converting, which main.py --convert does; starting without it')
+            path = self.path = None
+
+        if path is not None:
+            if os.path.isfile(path):
+                print('reading in from file')
+
+            if table_budget is not None:
+                self.explored = ejw45_TranspositionTable.open(path, table_budget)
+            else:
+                self.explored = ejw45_Table.open(path)
+
+            if os.path.isfile(self.endgame_path(path)):
+                ejw45_Endgame.load(self.endgame_path(path))
+            if os.path.isfile(self.book_path(path)):
+                self.book = ejw45_Book(self.book_path(path))
 
         if training_iterations > 0:
             self.train(training_iterations)
 
+    @staticmethod
+    def needs_conversion(path):
+        """:return: True if ejw45_convert has work to do on the knowledge base at path"""
+        if os.path.isfile(path):
+            return ejw45_KnowledgeBase.file_version(path) < ejw45_KnowledgeBase.version
+        return os.path.isfile(os.path.splitext(path)[0] + '.pickle')
+
+    def orientation(self, state):
+        """
+        :return: the symmetry to search state in (see ejw45_Symmetry): one the tree already holds the
+                 position in, so its statistics are kept, or else the canonical one
+        """
+        keys = ejw45_Symmetry.for_size(state.size).keys(state)
+        if self.root is not None and self.state.size == state.size:
+            for t, key in enumerate(keys):
+                if self.root.find(key, 2) is not None:
+                    return t
+        return keys.index(min(keys))
+
+    def reroot(self, state):
+        """
+        Move the root of the tree to state. If state is the root or lies within two plies of it
+        (our move followed by the opponent's), that subtree and its statistics are kept.
+        """
+        root = None
+        if self.root is not None and self.state.size == state.size:
+            root = self.root.find(state.key(), 2)
+
+        if root is None:
+            root = ejw45_Node(None, None, state.key(), not state.white_to_move, state.canonical_key())
+
+        root.parent = None
+        # the statistics are gathered afresh for every root; carried over they did worse
+        if root is not self.root:
+            self.rave = ejw45_Rave(state.size)
+
+        self.root = root
+        self.state = state.copy()
+
     def train(self, iterations):
+        grown = 0
         while iterations > 0:
-            self.simulate()
+            # every playout adds at most two nodes to the tree
+            grown += self.simulate()
             iterations -= 1
 
+            if self.tree_limit is not None and grown >= self.tree_limit:
+                self.root = None
+                self.reroot(self.state)
+                grown = 0
+
             if iterations % 10 == 0:
                 print('{}: {}'.format(iterations, len(self.explored)))
-                self.write_to_file('ejw45_amazon.pickle')
+                if isinstance(self.explored, ejw45_TranspositionTable):
+                    print('   ', ', '.join('{} {}'.format(name, round(value, 3))
+                                           for name, value in self.explored.statistics().items()))
+                self.explored.checkpoint()
 
-    def write_to_file(self, path):
-        with open(path, 'wb') as handle:
-            pickle.dump(self.explored, handle)
-
-    def select(self, current_state, player):
-
-        max_state = None
-        max_score = None
+        # compact the log into the knowledge base, so a finished run leaves one file to copy
+        if self.path is not None:
+            self.write_to_file(self.path)
 
-        child_boards, _ = current_state.moves(player)
-
-        # Return the next unexplored node. If none exist, recurse on the best scoring child
-        for child in child_boards:
+    @staticmethod
+    def endgame_path(path):
+        """:return: the file the ejw45_Endgame cache is kept in next to the knowledge base at path"""
+        return os.path.splitext(path)[0] + '.endgame'
 
-            # If you've found an unexplored node
-            if child not in self.explored:
-                player.update(current_state)
-                return current_state, player
+    @staticmethod
+    def book_path(path):
+        """:return: the file the ejw45_Book is read from next to the knowledge base at path"""
+        return os.path.splitext(path)[0] + '.book'
 
-            wins, plays = self.explored[child]
-            if max_score is None or wins / plays > max_score:
-                max_score = (wins / plays) + (1.4 * sqrt(log(plays) / plays))
-                max_state = child
+    def write_to_file(self, path):
+        self.explored.save(path)
+        ejw45_Endgame.save(self.endgame_path(path))
+
+    def widen(self, node):
+        """:return: True if node may get another child before the search descends past it"""
+        if node.untried is None:
+            return True
+        if not node.untried:
+            return False
+        if self.widening is None:
+            return True
+        return len(node.children) < self.widening * node.visits ** self.widening_exponent
+
+    def select(self, state):
+        """Descend from the root through nodes that may not widen, playing each chosen move on state."""
+        node = self.root
+        rave = self.rave if self.rave_equivalence is not None else None
+        while not self.widen(node) and node.children:
+            node = node.best_child(self.exploration, rave, self.rave_equivalence)
+            if node.key is not None:
+                state.apply(node.move)
+        return node
+
+    def candidates(self, node, state):
+        """
+        :return: the children node may have, as a list to pop from: the whole moves, or with
+                 two_stage the queen moves or the arrows, best last (random order without widening)
+        """
+        if not self.two_stage:
+            moves = state.moves()
+            random.shuffle(moves)
+            return moves
+
+        rays = state.rays
+        occupied = state.occupied()
+
+        if node.key is not None:
+            # queen moves, by how far the queen can shoot or move on from where she lands
+            moves = []
+            for source in ejw45_squares(state.queens(state.white_to_move)):
+                vacated = occupied ^ (1 << source)
+                for destination in ejw45_squares(rays.reach(source, occupied)):
+                    mobility = ejw45_popcount(rays.reach(destination, vacated | (1 << destination)))
+                    moves.append((mobility, random.random(), (source, destination)))
+        else:
+            # arrows, those next to and then in reach of the opponent's queens first
+            source, destination = node.move
+            occupied ^= (1 << source) | (1 << destination)
+            opponent = state.queens(not state.white_to_move)
+            near = rays.dilate(opponent)
+            reached = 0
+            for queen in ejw45_squares(opponent):
+                reached |= rays.reach(queen, occupied)
+
+            moves = []
+            for arrow in ejw45_squares(rays.reach(destination, occupied)):
+                bit = 1 << arrow
+                score = 2 * bool(bit & near) + bool(bit & reached)
+                moves.append((score, random.random(), (source, destination, arrow)))
+
+        if self.widening is None:
+            random.shuffle(moves)
+        else:
+            moves.sort()
+        return [move for _, _, move in moves]
 
-        player.update(max_state)
+    def expand(self, node, state):
+        """
+        Add one untried child to node and return it. A new queen node gets its first arrow child
+        straight away; a whole move is played on state.
+        """
+        if node.untried is None:
+            if profiler.enabled:
+                start = time.perf_counter()
+                node.untried = self.candidates(node, state)
+                profiler.add('movegen', time.perf_counter() - start)
+            else:
+                node.untried = self.candidates(node, state)
 
-        return self.select(max_state, player.other())
+        if not node.untried:
+            return node
 
-    def expand(self, current_state, player):
-        shuffled, _ = current_state.moves(player)
-        random.shuffle(shuffled)
-        for child in shuffled:
-            if child not in self.explored:
-                player.update(child)
-                return child, player.other()
+        move = node.untried.pop()
+        mover = state.white_to_move
 
-    def simulate(self):
-        selected, player = self.select(self.start, self.white_player)
-        expand, player = self.expand(selected, player)
+        if len(move) == 2:
+            child = ejw45_Node(move, node, None, mover)
+            node.children.append(child)
+            if profiler.enabled:
+                profiler.count('nodes')
+            return self.expand(child, state)
 
-        current = expand
-        game_end = False
+        state.apply(move)
 
-        loser = None
-        winner = None
+        if profiler.enabled:
+            start = time.perf_counter()
+            canonical = state.canonical_key()
+            profiler.add('hashing', time.perf_counter() - start)
+            profiler.count('nodes')
+        else:
+            canonical = state.canonical_key()
+
+        child = ejw45_Node(move, node, state.key(), mover, canonical)
+        if self.prior_visits:
+            self.seed(child)
+        node.children.append(child)
+        return child
+
+    def seed(self, node):
+        """Give a new node the win rate explored has for its position, over at most prior_visits visits."""
+        if profiler.enabled:
+            start = time.perf_counter()
+        known = self.explored.get(node.canonical)
+        if profiler.enabled:
+            profiler.add('explored', time.perf_counter() - start)
+            profiler.count('table_lookups')
+            profiler.count('table_hits', known is not None)
+
+        if known is not None and known[1]:
+            wins, plays = known
+            node.visits = min(plays, self.prior_visits)
+            node.wins = (wins * node.visits + plays // 2) // plays
+
+    def rollout(self, state, played=None):
+        """
+        Play random moves (see ejw45_BitBoard.random_move) on state until one side cannot move, or
+        until the game is decided by territory (see adjudicate and rollout_cap); return True if white won.
+        :param played: list to append the moves played to, or None
+        """
+        profile = profiler.enabled
+        plies = 0
+        while True:
+            if self.rollout_cap is not None and plies >= self.rollout_cap:
+                value = ejw45_Evaluator.for_size(state.size).evaluate(state)
+                if profile:
+                    profiler.count('rollouts')
+                    profiler.count('rollout_plies', plies)
+                return ejw45_white_wins(value, state.white_to_move)
+
+            if profile:
+                start = time.perf_counter()
+            separated = self.adjudicate and state.separated()
+            if separated:
+                margin = ejw45_Endgame.for_size(state.size).margin(state, self.endgame_nodes)
+            if profile:
+                profiler.add('adjudicate', time.perf_counter() - start)
+            if separated:
+                if profile:
+                    profiler.count('rollouts')
+                    profiler.count('rollout_plies', plies)
+                return ejw45_white_wins(margin, state.white_to_move)
+
+            if profile:
+                start = time.perf_counter()
+                move = state.random_move()
+                profiler.add('movegen', time.perf_counter() - start)
+            else:
+                move = state.random_move()
+
+            if move is None:
+                if profile:
+                    profiler.count('rollouts')
+                    profiler.count('rollout_plies', plies)
+                return not state.white_to_move
+
+            state.apply(move)
+            if played is not None:
+                played.append(move)
+            plies += 1
+
+    def backpropagate(self, node, white_wins, playouts=1):
+        """Credit playouts games, white_wins of them won by white, to node and its ancestors."""
+        while node is not None:
+            won = white_wins if node.white else playouts - white_wins
+            node.visits += playouts
+            node.wins += won
+
+            if node.canonical is not None:
+                if profiler.enabled:
+                    start = time.perf_counter()
+                    known = self.explored.get(node.canonical)
+                    wins, plays = known if known is not None else (0, 0)
+                    self.explored[node.canonical] = (wins + won, plays + playouts)
+                    profiler.add('explored', time.perf_counter() - start)
+                    profiler.count('table_lookups')
+                    profiler.count('table_hits', known is not None)
+                else:
+                    wins, plays = self.explored.get(node.canonical, (0, 0))
+                    self.explored[node.canonical] = (wins + won, plays + playouts)
 
-        while not game_end:
-            boards, _ = current.moves(player)
+            node = node.parent
 
-            if not boards:
-                loser = player
-                winner = player.other()
-                break
+    def simulate(self):
+        """
+        Run one select / expand / rollout / backpropagate iteration.
+        :return: the number of playouts it completed
+        """
+        # a single working state is played forward in place for the whole playout
+        state = self.state.copy()
+
+        profile = profiler.enabled
+        if profile:
+            start = time.perf_counter()
+
+        node = self.select(state)
+        if profile:
+            selected = time.perf_counter()
+            profiler.add('select', selected - start)
+
+        node = self.expand(node, state)
+        if profile:
+            expanded = time.perf_counter()
+            profiler.add('expand', expanded - selected)
+
+        # the whole moves from the root to node, then those of the rollout
+        played = None
+        if self.rave_equivalence is not None:
+            played = []
+            leaf = node
+            while leaf is not self.root:
+                if leaf.key is not None:
+                    played.append(leaf.move)
+                leaf = leaf.parent
+            played.reverse()
+
+        if self.rollout_batch > 1:
+            # the batched rollouts' moves are not kept, so only the tree's moves are credited
+            white_won = ejw45_BatchPlayout.for_size(state.size).run(state, self.rollout_batch,
+                                                                     adjudicate=self.adjudicate, cap=self.rollout_cap)
+            white_wins, playouts = int(white_won.sum()), self.rollout_batch
+        else:
+            white_wins, playouts = int(self.rollout(state, played)), 1
+        if profile:
+            rolled = time.perf_counter()
+            profiler.add('rollout', rolled - expanded)
+
+        self.backpropagate(node, white_wins, playouts)
+        if played:
+            self.rave.update(played, self.state.white_to_move, white_wins, playouts)
+        if profile:
+            profiler.add('backpropagate', time.perf_counter() - rolled)
+            profiler.count('playouts', playouts)
+        return playouts
+
+    def search(self, deadline):
+        """
+        Run playouts from the root until time_margin seconds before deadline (a time.perf_counter time).
+        :return: the number of playouts completed
+        """
+        stop = deadline - self.time_margin
+        iterations = 0
 
-            current = random.choice(boards)
-            player.update(current)
+        while time.perf_counter() < stop:
+            iterations += self.simulate()
 
-            player = player.other()
+        return iterations
 
-        for state in loser.path:
-            if state in self.explored:
-                wins, plays = self.explored[state]
+    def root_statistics(self):
+        """:return: a dict of move -> (wins, visits) for every searched move from the root"""
+        statistics = {}
+        for child in self.root.children:
+            if child.key is not None:
+                statistics[child.move] = (child.wins, child.visits)
             else:
-                wins = plays = 0
-
-            plays += 1
+                for arrow in child.children:
+                    statistics[arrow.move] = (arrow.wins, arrow.visits)
+        return statistics
 
-            self.explored[state] = (wins, plays)
+    def worker_count(self):
+        return self.workers if self.workers is not None else os.cpu_count() or 1
 
-        for state in winner.path:
-            if state in self.explored:
-                wins, plays = self.explored[state]
-            else:
-                wins = plays = 0
+    def parallel_search(self, deadline):
+        """
+        Root-parallel search: every extra worker process searches its own tree from the root
+        while this process keeps searching the shared tree, then the root statistics are summed.
+        Workers that have not reported back by the deadline are left out of the merge.
+        :return: (playouts completed across all processes, dict of move -> (wins, visits))
+        """
+        workers = self.worker_count()
+        if workers <= 1:
+            return self.search(deadline), self.root_statistics()
 
-            wins += 1
-            plays += 1
-            self.explored[state] = (wins, plays)
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers - 1)
 
+        state = self.state
+        position = (state.size, state.white, state.black, state.arrows, state.white_to_move)
+        margin = self.time_margin + self.merge_margin
 
-ejw45_mc = ejw45_MonteCarlo(100)
+        futures = [self.pool.submit(ejw45_search_worker, position, deadline, margin, random.getrandbits(64))
+                   for _ in range(workers - 1)]
 
+        time_margin = self.time_margin
+        self.time_margin = margin
+        try:
+            iterations = self.search(deadline)
+        finally:
+            self.time_margin = time_margin
 
-def ejw45_bot(board):
-    is_white = board.bWhite
+        statistics = self.root_statistics()
 
-    board = ejw45_Board(np.array(board.config))
-    player = ejw45_MonteCarlo.Player(is_white)
+        timeout = max(0.0, deadline - self.time_margin - time.perf_counter())
+        done, _ = concurrent.futures.wait(futures, timeout=timeout)
 
-    # Set a random move to be chosen if none of children boards are known
-    boards, moves = board.moves(player)
+        for future in done:
+            worker_iterations, worker_statistics = future.result()
+            iterations += worker_iterations
 
-    max_move = random.choice(moves)
-    max_score = 0.0
+            for move, (wins, visits) in worker_statistics.items():
+                total_wins, total_visits = statistics.get(move, (0, 0))
+                statistics[move] = (total_wins + wins, total_visits + visits)
 
-    for index, board in enumerate(boards):
-        move = moves[index]
+        return iterations, statistics
 
-        if board in ejw45_mc.explored:
-            win_count, play_count = ejw45_mc.explored[board]
-            score = float(win_count) / float(play_count)
+    def best_move(self, state, statistics=None):
+        """
+        The most visited move from the root, according to statistics or else this process's tree.
+        When the root has not been searched, fall back to the child with the best win rate in
+        explored, or a random move if none of them are known.
+        :return: a move of square numbers, or None if the side to move cannot move
+        """
+        if statistics is None:
+            statistics = self.root_statistics()
+
+        if statistics:
+            return max(statistics, key=lambda move: statistics[move][1])
+
+        moves = state.moves()
+        if not moves:
+            return None
+
+        # Set a random move to be chosen if none of children boards are known
+        max_move = random.choice(moves)
+        max_score = 0.0
+
+        for move in moves:
+            state.apply(move)
+            key = state.canonical_key()
+            state.undo(move)
+
+            if key in self.explored:
+                win_count, play_count = self.explored[key]
+                score = float(win_count) / float(play_count)
+
+                if score > max_score:
+                    max_score = score
+                    max_move = move
+
+        return max_move
+
+
+def ejw45_start_position(fname=None):
+    """
+    :param fname: setup file, as Amazons reads it, or None for the standard 10x10 game in the
+                  amazonsconfig.txt next to this file
+    :return: the game's start position as an ejw45_BitBoard, white to move
+    """
+    if fname is None:
+        fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'amazonsconfig.txt')
+    board = Amazons(fname, quiet=True).board
+    return ejw45_BitBoard.from_config(board.config, white_to_move=True)
+
+
+def ejw45_search_worker(position, deadline, time_margin, seed):
+    """
+    Search run in a worker process by ejw45_MonteCarlo.parallel_search: build an independent tree
+    from position until time_margin seconds before deadline.
+    :return: (playouts completed, dict of move -> (wins, visits) for the root's children)
+    """
+    # forked workers start with the parent's random state
+    random.seed(seed)
+
+    size, white, black, arrows, white_to_move = position
+    engine = ejw45_MonteCarlo(path=None)
+    engine.time_margin = time_margin
+    engine.reroot(ejw45_BitBoard(size, white, black, arrows, white_to_move))
+
+    iterations = engine.search(deadline)
+    return iterations, engine.root_statistics()
+
+
+# the shared engine, built by ejw45_engine on first use so that importing this file stays cheap
+ejw45_mc = None
+
+
+def ejw45_engine():
+    global ejw45_mc
+    if ejw45_mc is None:
+        ejw45_mc = ejw45_MonteCarlo()
+    return ejw45_mc
+
+
+def ejw45_convert(path='ejw45_amazon.kb'):
+    """
+    Bring the knowledge base at path up to date: set one of an older version aside, with its log, and
+    convert a pickle of the same name if there is no knowledge base. Run by --convert and --train rather
+    than when the engine is built, where it would eat into a move and game processes would race on the files.
+    """
+    if os.path.isfile(path) and ejw45_KnowledgeBase.file_version(path) < ejw45_KnowledgeBase.version:
+        # its keys cannot be turned into the current ones
+        outdated = '{}.v{}'.format(path, ejw45_KnowledgeBase.file_version(path))
+        print('setting', path, 'aside as', outdated)
+        os.replace(path, outdated)
+        if os.path.isfile(path + '.log'):
+            os.replace(path + '.log', outdated + '.log')
+
+    legacy = os.path.splitext(path)[0] + '.pickle'
+    if not os.path.isfile(path) and os.path.isfile(legacy):
+        print('converting', legacy, 'to', path)
+        ejw45_KnowledgeBase.from_pickle(legacy, path)
+
+
+def ejw45_train(iterations, fname=None, table_budget=None, tree_limit=None):
+    """Train the shared engine for the given number of playouts from the start of the game set up
+    in fname (the standard game if None), saving it as it goes.
+    :param table_budget: bytes to cap the explored table at, or None to let it grow
+    :param tree_limit: playouts per search tree (see ejw45_MonteCarlo.tree_limit), or None for the default
+    """
+    global ejw45_mc
+    ejw45_convert()
+    if table_budget is not None:
+        ejw45_mc = ejw45_MonteCarlo(table_budget=table_budget)
+    engine = ejw45_engine()
+    if tree_limit is not None:
+        engine.tree_limit = tree_limit
+    engine.reroot(ejw45_start_position(fname))
+    engine.train(iterations)
+
+
+@register_player
+def ejw45_bot(board):
+    state = ejw45_BitBoard.from_config(board.config, board.bWhite)
+
+    # once the queens are walled off the endgame is solved outright
+    move = ejw45_Endgame.for_size(state.size).best_move(state)
+    if move is not None:
+        return state.to_move(move)
+
+    engine = ejw45_engine()
+    if engine.use_book:
+        move = engine.book.lookup(state)
+        if move is not None:
+            print('ejw45_bot: book move')
+            return state.to_move(move)
+
+    # search the position in the orientation the tree already knows it in, or the canonical one,
+    # and turn the move back at the end
+    symmetry = ejw45_Symmetry.for_size(state.size)
+    orientation = engine.orientation(state)
+    oriented = symmetry.transform(state, orientation)
+    engine.reroot(oriented)
+
+    if board.time_limit is not None:
+        start = time.perf_counter()
+        iterations, statistics = engine.parallel_search(board.time_limit)
+        print('ejw45_bot: {} iterations in {:.2f} seconds'.format(iterations, time.perf_counter() - start))
+    else:
+        statistics = None
 
-            if score > max_score:
-                max_score = score
-                max_move = move
+    move = engine.best_move(oriented, statistics)
+    if move is None:
+        return False
 
-    return max_move
+    return state.to_move(symmetry.restore_move(move, orientation))
 
 
 ###################### Your code between these two comment lines ####################################
 
 def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--profile':
+        profiler.enabled = True
+        profiler.stream = open(sys.argv[2], 'a')
+        del sys.argv[1:3]
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--convert':
+        ejw45_convert()
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--train':
+        parser = argparse.ArgumentParser(prog='main.py --train', description='Train ejw45_bot by self-play')
+        parser.add_argument('iterations', type=int, help='playouts to train for')
+        parser.add_argument('setup', nargs='?', help='setup file to train from (default: the standard game)')
+        parser.add_argument('--table-mb', type=int, help='megabytes to cap the explored table at')
+        parser.add_argument('--tree-limit', type=int,
+                            help='playouts before starting a fresh search tree (default: {})'.format(
+                                ejw45_MonteCarlo.tree_limit))
+        args = parser.parse_args(sys.argv[2:])
+        ejw45_train(args.iterations, args.setup, args.table_mb << 20 if args.table_mb else None, args.tree_limit)
+        return
+
     if len(sys.argv) == 2:
         fname = sys.argv[1]
     else:
@@ -0,0 +1,277 @@
+# Perft: count the positions reachable in exactly depth moves, to test and time the move generators.
+#
+# Usage: python perft.py [amazonsconfig.txt ...] [--position 'q2q/4/4/Q2Q w' ...] --depth 2 --check
+#
+# With no setups given the 6x6, 8x8 and 10x10 setups are counted. Positions are written a row
+# at a time from the top row down, rows separated by '/', with Q, q and x as on the board and
+# a digit run for each stretch of empty squares, then 'w' or 'b' for the side to move.
+#
+# Generators:
+#   bitboard -- ejw45_BitBoard.iter_moves, with the last ply counted without being played
+#   board    -- ejw45_Board.moves, which is built on position_moves
+#   brute    -- Board.valid_path tried from every queen to every square, then again for the arrow
+# --check walks the tree and stops at the first position where the three disagree.
+# --cache remembers the count below every position by its Zobrist key, so transpositions
+# (the same arrows shot in another order) are only counted once.
+
+import argparse
+import re
+import sys
+import time
+
+import main
+
+# the standard 10x10 setup, from the literature
+KNOWN = {
+    '3q2q3/10/10/q8q/10/10/Q8Q/10/10/3Q2Q3 w': [1, 2176, 4307152],
+}
+
+SETUPS = ['amazonsconfig6.txt', 'amazonsconfig8.txt', 'amazonsconfig.txt']
+GENERATORS = ['bitboard', 'board', 'brute']
+
+
+def parse_position(text):
+    """:return: (config, white_to_move) from a position string"""
+    fields = text.split()
+    if len(fields) != 2 or fields[1] not in ('w', 'b'):
+        raise ValueError('expected rows and a side to move: {!r}'.format(text))
+
+    rows = []
+    for row in fields[0].split('/'):
+        cells = []
+        for run in re.findall(r'\d+|.', row):
+            if run.isdigit():
+                cells += ['.'] * int(run)
+            elif run in 'Qqx':
+                cells.append(run)
+            else:
+                raise ValueError('unknown square {!r} in {!r}'.format(run, text))
+        rows.append(cells)
+
+    if any(len(cells) != len(rows) for cells in rows):
+        raise ValueError('the board is not square: {!r}'.format(text))
+
+    # the string starts with the top row, config with row 0
+    return rows[::-1], fields[1] == 'w'
+
+
+def format_position(config, white_to_move):
+    rows = []
+    for cells in reversed(config):
+        row = re.sub(r'\.+', lambda empty: str(len(empty.group())), ''.join(cells))
+        rows.append(row)
+    return '/'.join(rows) + (' w' if white_to_move else ' b')
+
+
+def brute_moves(board):
+    """Every move Board.valid_move accepts, found by trying every square with valid_path."""
+    config = board.config
+    size = len(config)
+    squares = [(r, c) for r in range(size) for c in range(size)]
+    symbol = 'Q' if board.bWhite else 'q'
+
+    moves = []
+    for src in squares:
+        if config[src[0]][src[1]] != symbol:
+            continue
+        for dst in squares:
+            if not board.valid_path(src, dst):
+                continue
+            # as in Board.valid_move, the arrow flies with the queen on dst
+            config[src[0]][src[1]] = '.'
+            config[dst[0]][dst[1]] = symbol
+            moves += [(src, dst, adst) for adst in squares if board.valid_path(dst, adst)]
+            config[dst[0]][dst[1]] = '.'
+            config[src[0]][src[1]] = symbol
+    return moves
+
+
+def play(board, move):
+    (src, dst, adst) = move
+    config = board.config
+    config[dst[0]][dst[1]] = config[src[0]][src[1]]
+    config[src[0]][src[1]] = '.'
+    config[adst[0]][adst[1]] = 'x'
+    board.bWhite = not board.bWhite
+
+
+def unplay(board, move):
+    (src, dst, adst) = move
+    config = board.config
+    board.bWhite = not board.bWhite
+    config[adst[0]][adst[1]] = '.'
+    config[src[0]][src[1]] = config[dst[0]][dst[1]]
+    config[dst[0]][dst[1]] = '.'
+
+
+def perft_bitboard(state, depth, cache=None):
+    if depth == 0:
+        return 1
+
+    if cache is not None:
+        key = (state.key(), depth)
+        if key in cache:
+            return cache[key]
+
+    if depth == 1:
+        occupied = state.occupied()
+        reach = state.rays.reach
+        nodes = 0
+        for source in main.ejw45_squares(state.queens(state.white_to_move)):
+            vacated = occupied ^ (1 << source)
+            for destination in main.ejw45_squares(reach(source, occupied)):
+                nodes += main.ejw45_popcount(reach(destination, vacated | (1 << destination)))
+    else:
+        nodes = 0
+        for move in state.iter_moves():
+            state.apply(move)
+            nodes += perft_bitboard(state, depth - 1, cache)
+            state.undo(move)
+
+    if cache is not None:
+        cache[key] = nodes
+    return nodes
+
+
+def perft_board(board, white, depth, cache=None):
+    if depth == 0:
+        return 1
+
+    if cache is not None:
+        key = (hash(board), depth)
+        if key in cache:
+            return cache[key]
+
+    boards, moves = board.moves(white)
+    if depth == 1:
+        nodes = len(moves)
+    else:
+        nodes = sum(perft_board(child, not white, depth - 1, cache) for child in boards)
+
+    if cache is not None:
+        cache[key] = nodes
+    return nodes
+
+
+def perft_brute(board, depth, cache=None):
+    if depth == 0:
+        return 1
+
+    if cache is not None:
+        key = (main.ejw45_BitBoard.from_config(board.config, board.bWhite).key(), depth)
+        if key in cache:
+            return cache[key]
+
+    moves = brute_moves(board)
+    if depth == 1:
+        nodes = len(moves)
+    else:
+        nodes = 0
+        for move in moves:
+            play(board, move)
+            nodes += perft_brute(board, depth - 1, cache)
+            unplay(board, move)
+
+    if cache is not None:
+        cache[key] = nodes
+    return nodes
+
+
+def perft(config, white_to_move, depth, generator, cache=None):
+    """:return: the number of positions exactly depth moves from config"""
+    if generator == 'bitboard':
+        return perft_bitboard(main.ejw45_BitBoard.from_config(config, white_to_move), depth, cache)
+    if generator == 'board':
+        return perft_board(main.ejw45_Board(config), white_to_move, depth, cache)
+
+    return perft_brute(main.Board.from_config(config, white_to_move), depth, cache)
+
+
+def check(state, depth):
+    """
+    Compare the generators at every position down to depth.
+    :return: None, or (position, what differs) for the first position where they disagree
+    """
+    config = state.to_config()
+    board = main.Board.from_config(config, state.white_to_move)
+
+    found = {
+        'bitboard': set(state.to_move(move) for move in state.iter_moves()),
+        'board': set(main.ejw45_Board(config).moves(state.white_to_move)[1]),
+        'brute': set(brute_moves(board)),
+    }
+    for generator in ('bitboard', 'board'):
+        if found[generator] != found['brute']:
+            missing = sorted(found['brute'] - found[generator])
+            extra = sorted(found[generator] - found['brute'])
+            return format_position(config, state.white_to_move), '{} misses {} and adds {}'.format(
+                generator, missing[:5], extra[:5])
+
+    if depth > 1:
+        for move in state.moves():
+            state.apply(move)
+            problem = check(state, depth - 1)
+            state.undo(move)
+            if problem:
+                return problem
+    return None
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Count the positions reachable in exactly depth moves')
+    parser.add_argument('setups', nargs='*', metavar='config',
+                        help='setup files, as for main.py (default: {})'.format(', '.join(SETUPS)))
+    parser.add_argument('--position', action='append', default=[], help='a position string to count from')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--generator', action='append', choices=GENERATORS,
+                        help='generators to count with (default: bitboard)')
+    parser.add_argument('--check', type=int, nargs='?', const=-1, metavar='DEPTH',
+                        help='compare every generator with the brute force one, down to DEPTH (default: --depth)')
+    parser.add_argument('--cache', action='store_true', help='count each transposed position once')
+    args = parser.parse_args()
+
+    positions = []
+    for fname in args.setups or ([] if args.position else SETUPS):
+        board = main.Amazons(fname, quiet=True).board
+        positions.append((fname, board.config, board.bWhite))
+    for text in args.position:
+        try:
+            positions.append(('position',) + parse_position(text))
+        except ValueError as error:
+            parser.error(str(error))
+
+    failed = False
+    for name, config, white_to_move in positions:
+        text = format_position(config, white_to_move)
+        known = KNOWN.get(text, [])
+        print('{} ({}x{}): {}'.format(name, len(config), len(config), text))
+
+        if args.check is not None:
+            depth = args.depth if args.check < 0 else args.check
+            problem = check(main.ejw45_BitBoard.from_config(config, white_to_move), depth)
+            if problem:
+                print('  check to depth {} FAILED at {}: {}'.format(depth, *problem))
+                failed = True
+                continue
+            print('  check to depth {}: the generators agree'.format(depth))
+
+        for depth in range(1, args.depth + 1):
+            for generator in args.generator or ['bitboard']:
+                cache = {} if args.cache else None
+                start = time.perf_counter()
+                nodes = perft(config, white_to_move, depth, generator, cache)
+                elapsed = time.perf_counter() - start
+
+                verdict = ''
+                if depth < len(known):
+                    verdict = 'ok' if nodes == known[depth] else 'WRONG, expected {}'.format(known[depth])
+                    failed = failed or nodes != known[depth]
+                print('  depth {} {:<8} {:>14,} nodes {:>8.2f}s {:>12,.0f} nodes/sec {}'.format(
+                    depth, generator, nodes, elapsed, nodes / elapsed if elapsed else 0, verdict))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,201 @@
+# Headless tournaments between Amazons players.
+#
+# Usage: python tournament.py amazonsconfig.txt ejw45_bot random_player --games 100 --workers 4 --swap
+#
+# Players are looked up by name with main.find_player. Games are spread over a process pool
+# with nothing printed while they run; the results are summarised per player and can be
+# written out per game as CSV and as JSON.
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import io
+import json
+import random
+import time
+
+import main
+
+
+@main.register_player
+def random_player(board):
+    """Baseline opponent: a uniformly random legal move."""
+    state = main.ejw45_BitBoard.from_config(board.config, board.bWhite)
+    moves = state.moves()
+    if not moves:
+        return False
+    return state.to_move(random.choice(moves))
+
+
+def outcome(wscore, bscore):
+    """:return: (winning colour, margin, resigned) from the scores Amazons.play returns"""
+    if wscore == -1:
+        return 'black', 0, True
+    if bscore == -1:
+        return 'white', 0, True
+    if not wscore:
+        return 'black', bscore, False
+    return 'white', wscore, False
+
+
+def random_opening(game, plies, rng):
+    """
+    Play plies random moves on the game's board before the players take over.
+    :return: the scores, as Amazons.play returns them, if the opening ended the game, else None
+    """
+    board = game.board
+    for _ in range(plies):
+        state = main.ejw45_BitBoard.from_config(board.config, board.bWhite)
+        src, dst, adst = state.to_move(rng.choice(state.moves()))
+        board.move_queen(src, dst)
+        board.shoot_arrow(adst)
+
+        (wscore, bscore) = board.end_turn()
+        if not (wscore and bscore):
+            return wscore, bscore
+    return None
+
+
+def play_game(number, config, white, black, seed, opening_seed, opening_plies, time_limit):
+    random.seed(seed)
+
+    game = main.Amazons(config, quiet=True)
+    game.playerW = white
+    game.playerB = black
+    if time_limit is not None:
+        game.time_limit = time_limit
+
+    # Amazons.play starts with white, so run sets an even number of opening plies
+    scores = random_opening(game, opening_plies, random.Random(opening_seed))
+
+    start = time.perf_counter()
+    if scores is None:
+        # players may print as they think
+        with contextlib.redirect_stdout(io.StringIO()):
+            scores = game.play()
+    elapsed = time.perf_counter() - start
+    wscore, bscore = scores
+
+    colour, margin, resigned = outcome(wscore, bscore)
+    result = {
+        'game': number,
+        'white': white,
+        'black': black,
+        'winner': white if colour == 'white' else black,
+        'winner_colour': colour,
+        'margin': margin,
+        'resigned': resigned,
+        'plies': opening_plies + len(game.turns),
+        'seconds': elapsed,
+    }
+
+    for side, player in (('white', white), ('black', black)):
+        # white always moves first, so the turns alternate white, black, white, ...
+        turns = game.turns[0 if side == 'white' else 1::2]
+        times = [seconds for _, seconds, _ in turns]
+        result[side + '_moves'] = len(times)
+        result[side + '_mean_move'] = sum(times) / len(times) if times else 0.0
+        result[side + '_max_move'] = max(times) if times else 0.0
+        result[side + '_lost_turns'] = sum(1 for _, _, accepted in turns if not accepted)
+
+    return result
+
+
+def summarise(results):
+    summary = {}
+    for result in results:
+        for side in ('white', 'black'):
+            player = result[side]
+            stats = summary.setdefault(player, {'games': 0, 'wins': 0, 'margin': 0, 'moves': 0,
+                                                'move_seconds': 0.0, 'max_move_seconds': 0.0, 'lost_turns': 0})
+            won = result['winner_colour'] == side
+
+            stats['games'] += 1
+            stats['wins'] += won
+            stats['margin'] += result['margin'] if won else -result['margin']
+            stats['lost_turns'] += result[side + '_lost_turns']
+            stats['max_move_seconds'] = max(stats['max_move_seconds'], result[side + '_max_move'])
+
+            moves = result[side + '_moves']
+            stats['moves'] += moves
+            stats['move_seconds'] += result[side + '_mean_move'] * moves
+
+    for stats in summary.values():
+        stats['win_rate'] = stats['wins'] / float(stats['games'])
+        stats['mean_margin'] = stats['margin'] / float(stats['games'])
+        stats['mean_move_seconds'] = stats['move_seconds'] / stats['moves'] if stats['moves'] else 0.0
+        del stats['margin'], stats['move_seconds'], stats['moves']
+
+    return {
+        'games': len(results),
+        'white_win_rate': sum(result['winner_colour'] == 'white' for result in results) / float(len(results)),
+        'mean_plies': sum(result['plies'] for result in results) / float(len(results)),
+        'players': summary,
+    }
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Run many headless Amazons games between two players')
+    parser.add_argument('config', help='setup file, as for main.py')
+    parser.add_argument('first', help='player name; plays white unless colours are swapped')
+    parser.add_argument('second', help='player name')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None, help='processes to play games in (default: every core)')
+    parser.add_argument('--swap', action='store_true', help='swap colours every other game, keeping the opening')
+    parser.add_argument('--random-plies', type=int, default=0,
+                        help='random moves played before each game; an even number')
+    parser.add_argument('--time-limit', type=float, default=None, help='seconds per move instead of the config\'s')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='write one row per game to this file')
+    parser.add_argument('--json', help='write the summary and every game to this file')
+    args = parser.parse_args()
+
+    for name in (args.first, args.second):
+        try:
+            main.find_player(name)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.random_plies % 2:
+        parser.error('--random-plies must be even: the players take over with white to move')
+
+    jobs = []
+    for number in range(args.games):
+        swapped = args.swap and number % 2 == 1
+        white, black = (args.second, args.first) if swapped else (args.first, args.second)
+        # colour-swapped pairs replay the same opening
+        opening_seed = args.seed * 1000003 + (number // 2 if args.swap else number)
+        jobs.append((number, args.config, white, black, args.seed * 1000003 + number, opening_seed,
+                     args.random_plies, args.time_limit))
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(play_game, *job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print('game {game}: {white} (white) v {black} (black): {winner} wins by {margin} '
+                  'after {plies} plies'.format(**result))
+
+    results.sort(key=lambda result: result['game'])
+    summary = summarise(results)
+
+    print('{games} games, {mean_plies:.1f} plies on average, white won {white_win_rate:.0%}'.format(**summary))
+    for player, stats in sorted(summary['players'].items()):
+        print('  {:<16} won {wins}/{games} ({win_rate:.0%}), mean margin {mean_margin:+.1f}, '
+              'move time {mean_move_seconds:.2f}s mean {max_move_seconds:.2f}s max, '
+              '{lost_turns} lost turns'.format(player, **stats))
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump({'summary': summary, 'games': results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    run()